@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Controle de admissão para conversões de PDF
+Limita conversões simultâneas e memória estimada, rejeitando (429) quando
+o orçamento se esgota em vez de degradar todas as requisições em andamento
+"""
+
+import os
+import re
+import math
+import mmap
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Any
+
+
+_PAGE_PATTERN = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+_COUNT_PATTERN = re.compile(rb'/Count\s+(\d+)')
+
+
+class AdmissionRejected(Exception):
+    """Conversão recusada por falta de capacidade"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class ConversionCost:
+    """Custo estimado de uma conversão"""
+    size_bytes: int
+    pages: int
+    memory_mb: float
+
+
+def count_pdf_pages(pdf_bytes) -> int:
+    """
+    Conta páginas de um PDF sem abri-lo com o Docling
+
+    Usa os objetos /Type /Page e, quando estão em object streams comprimidos,
+    o maior /Count da árvore de páginas. Retorna pelo menos 1. Aceita bytes
+    ou um mmap do arquivo.
+    """
+    pages = sum(1 for _ in _PAGE_PATTERN.finditer(pdf_bytes))
+    for match in _COUNT_PATTERN.finditer(pdf_bytes):
+        pages = max(pages, int(match.group(1)))
+    return max(pages, 1)
+
+
+class AdmissionController:
+    """
+    Fila limitada de conversões com orçamento de concorrência e memória
+
+    Uma conversão é admitida quando há vaga (max_concurrent) e memória
+    (memory_budget_mb). Caso contrário aguarda em fila FIFO por até
+    queue_timeout segundos; fila cheia ou espera esgotada geram AdmissionRejected.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queue: int = 8,
+                 memory_budget_mb: float = 4096, queue_timeout: float = 30.0,
+                 base_mb: float = 200.0, mb_per_page: float = 30.0,
+                 mb_per_input_mb: float = 2.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.memory_budget_mb = memory_budget_mb
+        self.queue_timeout = queue_timeout
+
+        # Modelo de custo: base + por página + proporcional ao tamanho do arquivo
+        self.base_mb = base_mb
+        self.mb_per_page = mb_per_page
+        self.mb_per_input_mb = mb_per_input_mb
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._queue = deque()
+        self._in_flight = 0
+        self._memory_in_use = 0.0
+        self._queued_memory = 0.0
+
+        # Métricas
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._avg_seconds = None
+
+    def estimate(self, pdf_path: str) -> ConversionCost:
+        """
+        Estima o custo de conversão a partir do tamanho e do nº de páginas
+
+        O arquivo é varrido via mmap: antes da admissão o processo não aloca
+        memória proporcional ao upload (as páginas mapeadas vêm do page cache).
+        """
+        size = os.path.getsize(pdf_path)
+        if size == 0:
+            return self._cost(size, 1)
+        with open(pdf_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return self._cost(size, count_pdf_pages(mapped))
+
+    def estimate_bytes(self, pdf_bytes: bytes) -> ConversionCost:
+        return self._cost(len(pdf_bytes), count_pdf_pages(pdf_bytes))
+
+    def _cost(self, size_bytes: int, pages: int) -> ConversionCost:
+        size_mb = size_bytes / (1024 * 1024)
+        memory = self.base_mb + pages * self.mb_per_page + size_mb * self.mb_per_input_mb
+        # Um documento maior que o orçamento inteiro roda sozinho
+        memory = min(memory, self.memory_budget_mb)
+        return ConversionCost(size_bytes=size_bytes, pages=pages, memory_mb=round(memory, 1))
+
+    def _retry_after(self) -> int:
+        """Segundos sugeridos até haver capacidade (com base na duração média)"""
+        avg = self._avg_seconds or 5.0
+        waves = (len(self._queue) + self._in_flight) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(avg * max(waves, 1)))
+
+    def _can_run(self, cost: ConversionCost) -> bool:
+        return (self._in_flight < self.max_concurrent and
+                self._memory_in_use + cost.memory_mb <= self.memory_budget_mb)
+
+    def _reject(self, message: str) -> AdmissionRejected:
+        self._rejected += 1
+        return AdmissionRejected(message, self._retry_after())
+
+    @contextmanager
+    def admit(self, cost: ConversionCost):
+        """Reserva capacidade para uma conversão durante o bloco with"""
+        ticket = object()
+
+        with self._cond:
+            if not self._queue and self._can_run(cost):
+                self._start(cost)
+            else:
+                if len(self._queue) >= self.max_queue:
+                    raise self._reject('Fila de conversão cheia')
+                if self._queued_memory + cost.memory_mb > self.memory_budget_mb:
+                    raise self._reject('Orçamento de memória da fila esgotado')
+
+                self._queue.append(ticket)
+                self._queued_memory += cost.memory_mb
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while not (self._queue[0] is ticket and self._can_run(cost)):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timed_out += 1
+                            raise self._reject('Tempo de espera na fila esgotado')
+                        self._cond.wait(remaining)
+                finally:
+                    self._queue.remove(ticket)
+                    self._queued_memory -= cost.memory_mb
+                    # O próximo da fila pode ter ficado na frente
+                    self._cond.notify_all()
+                self._start(cost)
+
+        started = time.monotonic()
+        try:
+            yield cost
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._in_flight -= 1
+                self._memory_in_use -= cost.memory_mb
+                if self._avg_seconds is None:
+                    self._avg_seconds = elapsed
+                else:
+                    self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+                self._cond.notify_all()
+
+    def _start(self, cost: ConversionCost):
+        self._in_flight += 1
+        self._memory_in_use += cost.memory_mb
+        self._admitted += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """Estado atual da fila e contadores"""
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'queue_depth': len(self._queue),
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'memory_in_use_mb': round(self._memory_in_use, 1),
+                'memory_queued_mb': round(self._queued_memory, 1),
+                'memory_budget_mb': self.memory_budget_mb,
+                'admitted_total': self._admitted,
+                'rejected_total': self._rejected,
+                'queue_timeouts_total': self._timed_out,
+                'avg_conversion_seconds': round(self._avg_seconds, 3) if self._avg_seconds is not None else None,
+            }
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Pool supervisionado de processos para conversão de PDFs com o Docling
+Cada conversão tem prazo máximo; workers travados são mortos e substituídos,
+e workers são reciclados após N documentos ou ao ultrapassar o limite de RSS
+"""
+
+import time
+import queue
+import threading
+import multiprocessing
+from typing import Dict, Any, List, Optional
+
+from profiling import SamplingProfiler, active_capture, current_stack
+
+
+class ConversionTimeout(Exception):
+    """Conversão excedeu o prazo e o worker foi encerrado"""
+
+
+class ConversionFailed(Exception):
+    """Conversão falhou dentro do worker (ou o worker morreu)"""
+
+
+def _rss_mb() -> float:
+    """RSS atual do processo em MB"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _worker_main(conn):
+    """Loop do processo worker: recebe caminhos de PDF e devolve markdown"""
+    # Com start method 'fork', reaproveita o conversor já carregado no processo pai
+    from invoice_extractor import get_document_converter, initialize_pdf_pipeline, export_markdown
+    converter = get_document_converter()
+    # Só anuncia 'ready' com os modelos de layout carregados
+    initialize_pdf_pipeline(converter)
+    conn.send(('ready', None, _rss_mb(), None))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        # (caminho do PDF, intervalo de amostragem ou None)
+        pdf_path, profile_interval = message
+
+        sampler = None
+        if profile_interval:
+            sampler = SamplingProfiler(threading.get_ident(), profile_interval)
+            sampler.start()
+        try:
+            result = converter.convert(pdf_path)
+            reply = ['ok', export_markdown(result.document)]
+        except Exception as e:
+            reply = ['error', str(e)]
+        samples = None
+        if sampler is not None:
+            sampler.stop()
+            samples = (dict(sampler.samples), dict(sampler.seconds))
+        conn.send((reply[0], reply[1], _rss_mb(), samples))
+
+
+class _Worker:
+    """Processo worker e o lado supervisor do seu pipe"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.docs = 0
+        self.rss_mb = 0.0
+        self.started_at = time.monotonic()
+
+    def kill(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process.join(1)
+
+
+class ConversionPool:
+    """
+    Executa conversões Docling em processos supervisionados
+
+    Args:
+        workers: número de processos ativos
+        timeout: prazo (segundos) por documento; ao estourar, o worker é morto
+        max_docs_per_worker: recicla o worker após esse número de documentos
+        max_rss_mb: recicla o worker quando o RSS passa desse limite
+        prewarm: workers reserva já iniciados (modelos carregados) para substituição
+        startup_timeout: prazo para um worker novo carregar o Docling
+        start_method: método de início do multiprocessing ('spawn', 'forkserver', ...).
+            Em 'forkserver', o forkserver pré-carrega o Docling (docling_preload)
+            e os workers nascem dele já com os modelos
+        acquire_timeout: espera máxima por um worker livre; ao estourar, ConversionFailed
+
+    Os processos só são iniciados em start() ou na primeira conversão.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 120.0,
+                 max_docs_per_worker: int = 50, max_rss_mb: float = 3072.0,
+                 prewarm: int = 1, startup_timeout: float = 300.0,
+                 start_method: str = 'spawn', acquire_timeout: float = 30.0):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_docs_per_worker = max_docs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.prewarm = prewarm
+        self.startup_timeout = startup_timeout
+        self.start_method = start_method
+        self.acquire_timeout = acquire_timeout
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            # O forkserver é single-thread e nunca converte: nenhum pool de
+            # threads (werkzeug, torch/OpenMP) existe no momento do fork
+            self._context.set_forkserver_preload(['docling_preload'])
+
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._spares: List[_Worker] = []
+        self._started = False
+        self._closed = False
+
+        # Métricas
+        self._converted = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._crashed = 0
+        self._acquire_timeouts = 0
+
+    def start(self):
+        """Inicia os workers ativos e as reservas"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.workers):
+                self._idle.put(_Worker(self._context))
+            for _ in range(self.prewarm):
+                self._spares.append(_Worker(self._context))
+
+    def _replace(self, worker: _Worker):
+        """Encerra o worker e coloca um substituto (reserva, se houver) em uso"""
+        worker.kill()
+        with self._lock:
+            if self._closed:
+                return
+            replacement = self._spares.pop(0) if self._spares else _Worker(self._context)
+            # Repor a reserva enquanto o substituto atende
+            while len(self._spares) < self.prewarm:
+                self._spares.append(_Worker(self._context))
+        self._idle.put(replacement)
+
+    def _ensure_ready(self, worker: _Worker, timeout: Optional[float] = None):
+        if worker.ready:
+            return
+        if not worker.conn.poll(self.startup_timeout if timeout is None else timeout):
+            raise ConversionFailed('Worker de conversão não inicializou a tempo')
+        try:
+            status, _, rss, _ = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join(1)
+            raise ConversionFailed(
+                f'Worker de conversão encerrado durante a inicialização (exit code {worker.process.exitcode})'
+            )
+        worker.ready = status == 'ready'
+        worker.rss_mb = rss
+
+    def wait_ready(self, timeout: Optional[float] = None):
+        """
+        Inicia os workers e aguarda cada worker ativo carregar o Docling
+
+        Raises:
+            ConversionFailed: algum worker não concluiu a inicialização no prazo
+        """
+        self.start()
+        deadline = time.monotonic() + (self.startup_timeout if timeout is None else timeout)
+        checked = []
+        try:
+            for _ in range(self.workers):
+                try:
+                    worker = self._idle.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    raise ConversionFailed('Workers de conversão não ficaram prontos a tempo')
+                try:
+                    self._ensure_ready(worker, max(deadline - time.monotonic(), 0))
+                except ConversionFailed:
+                    self._replace(worker)
+                    raise
+                checked.append(worker)
+        finally:
+            for worker in checked:
+                self._idle.put(worker)
+
+    def convert_to_markdown(self, pdf_path: str) -> str:
+        """
+        Converte um PDF em markdown num worker supervisionado
+
+        Raises:
+            ConversionTimeout: o documento excedeu o prazo
+            ConversionFailed: erro na conversão, falha do worker ou nenhum
+                worker livre em acquire_timeout
+
+        Se a requisição estiver sendo perfilada, o worker amostra a própria
+        pilha e as amostras entram na captura, sob a chamada desta função;
+        a amostragem da thread da requisição fica suspensa durante a espera.
+        """
+        if not self._started:
+            self.start()
+        capture = active_capture()
+        try:
+            worker = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            with self._lock:
+                self._acquire_timeouts += 1
+            raise ConversionFailed(f'Nenhum worker de conversão livre em {self.acquire_timeout:g}s')
+        try:
+            try:
+                self._ensure_ready(worker)
+            except ConversionFailed:
+                self._replace(worker)
+                worker = None
+                raise
+            worker.conn.send((pdf_path, capture.interval if capture is not None else None))
+
+            if capture is not None:
+                capture.profiler.pause()
+            try:
+                if not worker.conn.poll(self.timeout):
+                    with self._lock:
+                        self._timeouts += 1
+                    self._replace(worker)
+                    worker = None
+                    raise ConversionTimeout(f'Conversão excedeu {self.timeout:.0f}s')
+
+                status, payload, rss, samples = worker.conn.recv()
+            finally:
+                if capture is not None:
+                    capture.profiler.resume()
+            worker.docs += 1
+            worker.rss_mb = rss
+
+            if samples:
+                prefix = current_stack() + (('<worker>', 0, f'docling worker (pid {worker.process.pid})'),)
+                capture.merge(*samples, prefix=prefix)
+
+            if worker.docs >= self.max_docs_per_worker or rss >= self.max_rss_mb:
+                with self._lock:
+                    self._recycled += 1
+                self._replace(worker)
+                worker = None
+
+            with self._lock:
+                if status == 'ok':
+                    self._converted += 1
+                else:
+                    self._failed += 1
+            if status != 'ok':
+                raise ConversionFailed(payload)
+            return payload
+
+        except (EOFError, OSError):
+            # Worker morreu (ex.: OOM killer) durante a conversão
+            with self._lock:
+                self._crashed += 1
+            self._replace(worker)
+            exitcode = worker.process.exitcode
+            worker = None
+            raise ConversionFailed(f'Worker de conversão encerrado inesperadamente (exit code {exitcode})')
+
+        finally:
+            if worker is not None:
+                self._idle.put(worker)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'idle_workers': self._idle.qsize(),
+                'spare_workers': len(self._spares),
+                'converted_total': self._converted,
+                'failed_total': self._failed,
+                'timeouts_total': self._timeouts,
+                'recycled_total': self._recycled,
+                'crashed_total': self._crashed,
+                'acquire_timeouts_total': self._acquire_timeouts,
+            }
+
+    def shutdown(self):
+        """Encerra todos os workers"""
+        with self._lock:
+            self._closed = True
+            spares, self._spares = self._spares, []
+        for worker in spares:
+            worker.kill()
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
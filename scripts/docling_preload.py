@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Pré-carregamento do Docling no forkserver do pool de conversão
+Com CONVERSION_START_METHOD=forkserver, o forkserver importa este módulo uma
+única vez: carrega o conversor e o pipeline de PDF, e cada worker de conversão
+nasce por fork desse processo, com os modelos já em memória (copy-on-write)
+"""
+
+try:
+    from invoice_extractor import get_document_converter, initialize_pdf_pipeline
+    initialize_pdf_pipeline(get_document_converter())
+except Exception as e:
+    # Sem o pré-carregamento, cada worker carrega o Docling ao iniciar
+    print(f"[forkserver {__import__('os').getpid()}] Docling não pré-carregado: {e}")
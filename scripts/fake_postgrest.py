@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Servidor PostgREST falso (em memória) para testes de carga offline
+Atende o subconjunto da API REST do Supabase usado pelo invoice_api:
+select com filtros (eq, neq, gt, gte, lt, lte, is), .single(), update e insert
+
+Uso:
+    python fake_postgrest.py --port 54321 --tenants 5 --payables 2000
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_SERVICE_ROLE_KEY=fake.fake.fake python invoice_api.py
+"""
+
+import json
+import random
+import argparse
+import threading
+import uuid
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional
+from urllib.parse import urlsplit, parse_qsl
+
+
+# Chave com formato de JWT aceita pelo cliente supabase-py
+FAKE_SERVICE_KEY = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.fake'
+
+
+def _format_cnpj(digits: str) -> str:
+    return f'{digits[:2]}.{digits[2:5]}.{digits[5:8]}/{digits[8:12]}-{digits[12:]}'
+
+
+class FakeDatabase:
+    """Tabelas em memória (payables, pessoas, audit_logs) com dados sintéticos"""
+
+    def __init__(self, tenants: int = 3, payables_per_tenant: int = 500,
+                 suppliers_per_tenant: int = 50, seed: int = 42):
+        self.lock = threading.Lock()
+        self.tables: Dict[str, List[Dict[str, Any]]] = {'payables': [], 'pessoas': [], 'audit_logs': []}
+        self.company_ids: List[str] = []
+        rng = random.Random(seed)
+        today = date.today()
+
+        for _ in range(tenants):
+            company_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            self.company_ids.append(company_id)
+
+            suppliers = []
+            for s in range(suppliers_per_tenant):
+                supplier = {
+                    'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                    'company_id': company_id,
+                    'razao_social': f'Fornecedor {s} Ltda',
+                    'nome_fantasia': f'Fornecedor {s}',
+                    'cpf_cnpj': _format_cnpj(''.join(str(rng.randint(0, 9)) for _ in range(14))),
+                }
+                suppliers.append(supplier)
+                self.tables['pessoas'].append(supplier)
+
+            for _ in range(payables_per_tenant):
+                supplier = rng.choice(suppliers)
+                self.tables['payables'].append({
+                    'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                    'company_id': company_id,
+                    'supplier_id': supplier['id'],
+                    'amount': round(rng.uniform(50, 50000), 2),
+                    'due_date': (today + timedelta(days=rng.randint(-60, 120))).isoformat(),
+                    'document_number': str(rng.randint(1000, 999999)),
+                    'document_type': rng.choice(['boleto', 'fatura', 'nota_fiscal']),
+                    'description': 'Lançamento sintético',
+                    'is_paid': False,
+                    'is_forecast': rng.random() < 0.1,
+                    'reconciled_at': None,
+                    'reconciliation_source': None,
+                })
+
+        self._pessoas_by_id = {p['id']: p for p in self.tables['pessoas']}
+
+    def payables_for(self, company_id: str) -> List[Dict[str, Any]]:
+        return [p for p in self.tables['payables'] if p['company_id'] == company_id]
+
+    def with_embeds(self, table: str, row: Dict[str, Any], select: str) -> Dict[str, Any]:
+        """Resolve o embed supplier:pessoas(...) usado pelo invoice_api"""
+        if table == 'payables' and 'supplier:pessoas' in select:
+            row = dict(row, supplier=self._pessoas_by_id.get(row.get('supplier_id')))
+        return row
+
+
+def _coerce(value: str, current: Any) -> Any:
+    if value == 'null':
+        return None
+    if value in ('true', 'false'):
+        return value == 'true'
+    if isinstance(current, (int, float)) and not isinstance(current, bool):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _matches(row: Dict[str, Any], filters: List[tuple]) -> bool:
+    for column, op, raw in filters:
+        current = row.get(column)
+        if op == 'is':
+            if _coerce(raw, current) is not current:
+                return False
+            continue
+        value = _coerce(raw, current)
+        if op == 'eq' and current != value:
+            return False
+        if op == 'neq' and current == value:
+            return False
+        if op in ('gt', 'gte', 'lt', 'lte'):
+            if current is None:
+                return False
+            if op == 'gt' and not current > value:
+                return False
+            if op == 'gte' and not current >= value:
+                return False
+            if op == 'lt' and not current < value:
+                return False
+            if op == 'lte' and not current <= value:
+                return False
+    return True
+
+
+class PostgrestHandler(BaseHTTPRequestHandler):
+    """Handler HTTP para /rest/v1/<tabela>"""
+
+    db: FakeDatabase = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        table = parts.path.rstrip('/').split('/')[-1]
+        select = '*'
+        filters = []
+        for key, value in parse_qsl(parts.query, keep_blank_values=True):
+            if key == 'select':
+                select = value
+            elif key in ('order', 'limit', 'offset', 'columns'):
+                continue
+            elif '.' in value:
+                op, raw = value.split('.', 1)
+                filters.append((key, op, raw))
+        return table, select, filters
+
+    def _body(self) -> Any:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _send(self, status: int, payload: Any):
+        data = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _result(self, rows: List[Dict[str, Any]], status: int = 200):
+        if 'vnd.pgrst.object' in (self.headers.get('Accept') or ''):
+            if len(rows) != 1:
+                return self._send(406, {
+                    'code': 'PGRST116',
+                    'message': 'JSON object requested, multiple (or no) rows returned',
+                    'details': f'The result contains {len(rows)} rows',
+                    'hint': None,
+                })
+            return self._send(status, rows[0])
+        return self._send(status, rows)
+
+    def do_GET(self):
+        table, select, filters = self._parse()
+        if table not in self.db.tables:
+            return self._send(404, {'message': f'relation "{table}" does not exist'})
+        with self.db.lock:
+            rows = [self.db.with_embeds(table, r, select)
+                    for r in self.db.tables[table] if _matches(r, filters)]
+        self._result(rows)
+
+    def do_PATCH(self):
+        table, select, filters = self._parse()
+        changes = self._body() or {}
+        with self.db.lock:
+            rows = [r for r in self.db.tables.get(table, []) if _matches(r, filters)]
+            for row in rows:
+                row.update(changes)
+            rows = [dict(r) for r in rows]
+        self._result(rows)
+
+    def do_POST(self):
+        table, select, filters = self._parse()
+        body = self._body()
+        items = body if isinstance(body, list) else [body]
+        with self.db.lock:
+            inserted = []
+            for item in items:
+                row = dict(item, id=item.get('id') or str(uuid.uuid4()))
+                self.db.tables.setdefault(table, []).append(row)
+                inserted.append(row)
+        self._result(inserted, status=201)
+
+
+def start_server(db: FakeDatabase, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """Inicia o servidor em uma thread daemon (port=0 escolhe uma porta livre)"""
+    handler = type('BoundPostgrestHandler', (PostgrestHandler,), {'db': db})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='PostgREST falso para testes offline')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--tenants', type=int, default=3)
+    parser.add_argument('--payables', type=int, default=500, help='Payables por empresa')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    db = FakeDatabase(tenants=args.tenants, payables_per_tenant=args.payables, seed=args.seed)
+    server = start_server(db, args.host, args.port)
+    print(f'PostgREST falso em http://{args.host}:{server.server_address[1]}')
+    print(f'Empresas: {", ".join(db.company_ids)}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,32 +4,201 @@ API para extração e cruzamento de faturas com lançamentos financeiros
 Integra com o Flow Layout Hub via Supabase
 """
 
+import time
+_import_started = time.perf_counter()
+
 import os
+import sys
+import hmac
 import json
+import atexit
+import threading
 import tempfile
-from flask import Flask, request, jsonify
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-from supabase import create_client, Client
-from invoice_extractor import InvoiceExtractor, PayableMatcher, ExtractedInvoiceData
+from invoice_extractor import (
+    InvoiceExtractor, PayableMatcher, ExtractedInvoiceData,
+    create_text_pool, extract_from_texts, get_document_converter, initialize_pdf_pipeline,
+    SEGMENT_MODES
+)
+from markdown_store import MarkdownStore
+from admission import AdmissionController, AdmissionRejected
+from conversion_pool import ConversionPool
+from match_cache import MatchCache, PayablesVersions
+from payables_snapshot import PayablesSnapshotStore
+from profiling import RequestProfiler
 from dataclasses import asdict
 from datetime import datetime, timedelta
 
 app = Flask(__name__)
 CORS(app)
 
-# Configuração Supabase
+# Configuração Supabase (cliente criado no primeiro uso)
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_KEY = os.environ.get('SUPABASE_SERVICE_ROLE_KEY', '')
 
-supabase: Client = None
-if SUPABASE_URL and SUPABASE_KEY:
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+_supabase = None
+_supabase_lock = threading.Lock()
+
+
+def get_supabase():
+    """Cliente Supabase do processo (None se não configurado)"""
+    global _supabase
+    if _supabase is None and SUPABASE_URL and SUPABASE_KEY:
+        with _supabase_lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
+
+# Armazenamento do markdown convertido (opcional) para reprocessamento
+MARKDOWN_STORE_DIR = os.environ.get('MARKDOWN_STORE_DIR', '')
+markdown_store = MarkdownStore(MARKDOWN_STORE_DIR) if MARKDOWN_STORE_DIR else None
+
+# Controle de admissão das conversões de PDF
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get('ADMISSION_MAX_CONCURRENT', 2)),
+    max_queue=int(os.environ.get('ADMISSION_MAX_QUEUE', 8)),
+    memory_budget_mb=float(os.environ.get('ADMISSION_MEMORY_BUDGET_MB', 4096)),
+    queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 30)),
+)
+
+# Conversões em processos supervisionados (CONVERSION_WORKERS=0 converte no próprio processo)
+CONVERSION_WORKERS = int(os.environ.get('CONVERSION_WORKERS', admission.max_concurrent))
+conversion_pool = None
+if CONVERSION_WORKERS > 0:
+    conversion_pool = ConversionPool(
+        workers=CONVERSION_WORKERS,
+        timeout=float(os.environ.get('CONVERSION_TIMEOUT', 120)),
+        max_docs_per_worker=int(os.environ.get('CONVERSION_MAX_DOCS', 50)),
+        max_rss_mb=float(os.environ.get('CONVERSION_MAX_RSS_MB', 3072)),
+        prewarm=int(os.environ.get('CONVERSION_PREWARM', 1)),
+        start_method=os.environ.get('CONVERSION_START_METHOD', 'spawn'),
+        acquire_timeout=admission.queue_timeout,
+    )
+    atexit.register(conversion_pool.shutdown)
+    # Uma conversão admitida sempre encontra worker livre: o excedente espera
+    # (e recebe 429) na fila de admissão, não no pool
+    admission.max_concurrent = min(admission.max_concurrent, CONVERSION_WORKERS)
+
+# Cache de resultados do /match, invalidado pela versão dos payables da empresa
+# (a versão fica em disco, compartilhada por todos os workers da máquina)
+payables_versions = PayablesVersions(
+    os.environ.get('PAYABLES_VERSION_DIR') or os.path.join(tempfile.gettempdir(), 'invoice-payables-versions')
+)
+# Segredo compartilhado com o trigger de payables do banco (/payables/changed)
+PAYABLES_WEBHOOK_SECRET = os.environ.get('PAYABLES_WEBHOOK_SECRET', '')
+match_cache = MatchCache(
+    max_entries=int(os.environ.get('MATCH_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('MATCH_CACHE_TTL', 300)),
+)
+
+# Snapshot colunar dos payables compartilhado entre processos (opcional)
+PAYABLES_SNAPSHOT_DIR = os.environ.get('PAYABLES_SNAPSHOT_DIR', '')
+snapshot_store = PayablesSnapshotStore(
+    PAYABLES_SNAPSHOT_DIR,
+    max_age=float(os.environ.get('PAYABLES_SNAPSHOT_MAX_AGE', os.environ.get('MATCH_CACHE_TTL', 300))),
+    max_open=int(os.environ.get('PAYABLES_SNAPSHOT_MAX_OPEN', 64)),
+) if PAYABLES_SNAPSHOT_DIR else None
+
+# Extração em lote de textos (pool de processos criado no primeiro uso)
+TEXT_EXTRACTION_WORKERS = int(os.environ.get('TEXT_EXTRACTION_WORKERS', os.cpu_count() or 1))
+EXTRACT_BATCH_MAX_TEXTS = int(os.environ.get('EXTRACT_BATCH_MAX_TEXTS', 10000))
+_text_pool = None
+_text_pool_lock = threading.Lock()
+
+
+# Perfilamento sob demanda (amostragem ou cabeçalho X-Profile com X-Admin-Token)
+profiler = RequestProfiler(
+    directory=os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'invoice-profiles'),
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    admin_token=os.environ.get('ADMIN_TOKEN', ''),
+    max_captures=int(os.environ.get('PROFILE_MAX_CAPTURES', 50)),
+    interval=float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000,
+)
+
+
+def get_text_pool():
+    """
+    Pool de processos compartilhado pelas requisições de /extract-batch
+    
+    Se um worker do pool morreu (OOM killer, segfault), o ProcessPoolExecutor
+    fica quebrado para sempre; nesse caso é descartado e um novo é criado.
+    """
+    global _text_pool
+    with _text_pool_lock:
+        if _text_pool is not None and getattr(_text_pool, '_broken', False):
+            _text_pool.shutdown(wait=False, cancel_futures=True)
+            _text_pool = None
+        if _text_pool is None:
+            _text_pool = create_text_pool(TEXT_EXTRACTION_WORKERS)
+        return _text_pool
+
+
+def discard_text_pool(pool):
+    """Descarta o pool quebrado; a próxima chamada de get_text_pool cria outro"""
+    global _text_pool
+    with _text_pool_lock:
+        if _text_pool is pool:
+            _text_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _shutdown_text_pool():
+    if _text_pool is not None:
+        _text_pool.shutdown()
+
+
+atexit.register(_shutdown_text_pool)
+
+
+def extract_pdf(extractor: InvoiceExtractor, pdf_path: str, source_name: str = None) -> ExtractedInvoiceData:
+    """
+    Converte um PDF passando pelo controle de admissão
+    
+    Raises:
+        AdmissionRejected: sem capacidade para a conversão
+    """
+    cost = admission.estimate(pdf_path)
+    with admission.admit(cost):
+        return extractor.extract_from_pdf(pdf_path, source_name=source_name)
+
+
+def extract_pdf_segments(extractor: InvoiceExtractor, pdf_path: str, mode: str,
+                         source_name: str = None) -> list:
+    """
+    Converte um PDF uma vez (com controle de admissão) e extrai cada segmento
+    
+    Raises:
+        AdmissionRejected: sem capacidade para a conversão
+    """
+    cost = admission.estimate(pdf_path)
+    with admission.admit(cost):
+        segments = extractor.extract_segments_from_pdf(pdf_path, mode=mode, source_name=source_name)
+    # A extração por segmento (só regex) roda fora da vaga de conversão
+    return list(segments)
 
 
-def get_payables_for_matching(company_id: str, filters: dict = None) -> list:
+def rejected_response(error: AdmissionRejected):
+    """Resposta 429 com Retry-After para conversões recusadas"""
+    response = jsonify({
+        'success': False,
+        'error': str(error),
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+
+def get_payables_for_matching(company_id: str, filters: dict = None, raise_errors: bool = False) -> list:
     """
     Busca contas a pagar do Supabase para cruzamento
+    
+    Erros na consulta retornam lista vazia, ou são propagados com raise_errors
+    (quando uma lista vazia seria guardada como resultado, ex.: no snapshot).
     """
+    supabase = get_supabase()
     if not supabase:
         return []
     
@@ -74,16 +243,201 @@ def get_payables_for_matching(company_id: str, filters: dict = None) -> list:
         
     except Exception as e:
         print(f"Erro ao buscar payables: {e}")
+        if raise_errors:
+            raise
         return []
 
 
+def get_payables_snapshot(company_id: str, filters: dict = None):
+    """
+    Payables da empresa lidos do snapshot compartilhado (PayablesView)
+    
+    Publica uma nova geração a partir do Supabase quando não há uma vigente
+    ou quando ela passou de PAYABLES_SNAPSHOT_MAX_AGE (empresa sem payables
+    gera uma visão vazia). Retorna None se o snapshot não estiver configurado,
+    se a busca falhar ou se a empresa tiver sido invalidada durante a busca;
+    nesses casos o chamador lê direto do banco.
+    """
+    if snapshot_store is None:
+        return None
+    
+    snapshot = snapshot_store.open(company_id)
+    if snapshot is None:
+        try:
+            snapshot = snapshot_store.refresh(
+                company_id, lambda: get_payables_for_matching(company_id, raise_errors=True)
+            )
+        except Exception:
+            return None
+        if snapshot is None:
+            return None
+    
+    return snapshot.select(filters)
+
+
+def invalidate_payables(company_id: str) -> int:
+    """Invalida cache do /match e snapshot da empresa; retorna a nova versão"""
+    if snapshot_store is not None:
+        snapshot_store.invalidate(company_id)
+    return payables_versions.bump(company_id)
+
+
+# Tempos de inicialização (imports e aquecimento), expostos em /ready.
+# WARM_UP_MODELS=0 não carrega o Docling no aquecimento (ex.: teste de carga
+# offline sem conversões); a primeira conversão paga o carregamento.
+WARM_UP_MODELS = os.environ.get('WARM_UP_MODELS', '1') != '0'
+startup_timings = {}
+_ready = threading.Event()
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+
+def preload_models():
+    """
+    Importa o Docling e carrega os modelos no processo atual
+    
+    Só faz sentido quando a conversão roda neste processo (ou em workers
+    criados por fork dele); com o pool em 'spawn', cada worker carrega os seus.
+    """
+    if conversion_pool is not None and conversion_pool.start_method != 'fork':
+        return
+    
+    started = time.perf_counter()
+    converter = get_document_converter()
+    startup_timings['docling_load_s'] = round(time.perf_counter() - started, 3)
+    
+    # Inicializa o pipeline de PDF (modelos de layout) antes da primeira requisição
+    started = time.perf_counter()
+    initialize_pdf_pipeline(converter)
+    startup_timings['pipeline_init_s'] = round(time.perf_counter() - started, 3)
+
+
+def warm_up(load_models: bool = True):
+    """
+    Aquece o processo (modelos, cliente Supabase, workers de conversão) e o marca como pronto
+    
+    Com o pool de conversão, só fica pronto depois que cada worker ativo
+    confirma que carregou o Docling.
+    """
+    started = time.perf_counter()
+    try:
+        if WARM_UP_MODELS and load_models:
+            preload_models()
+        
+        t = time.perf_counter()
+        get_supabase()
+        startup_timings['supabase_client_s'] = round(time.perf_counter() - t, 3)
+        
+        if WARM_UP_MODELS and conversion_pool is not None:
+            t = time.perf_counter()
+            conversion_pool.wait_ready()
+            startup_timings['conversion_workers_s'] = round(time.perf_counter() - t, 3)
+        
+        startup_timings['warm_up_s'] = round(time.perf_counter() - started, 3)
+        _ready.set()
+        print(f"[{os.getpid()}] Pronto. Tempos de inicialização: {json.dumps(startup_timings)}")
+    except Exception as e:
+        startup_timings['warm_up_error'] = str(e)
+        print(f"[{os.getpid()}] Erro no aquecimento: {e}")
+
+
+def start_warm_up(load_models: bool = True):
+    """Dispara o aquecimento em segundo plano (uma vez por processo)"""
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up, args=(load_models,), daemon=True).start()
+
+
+@app.before_request
+def start_profile():
+    """Inicia a captura quando a requisição for sorteada ou pedida via cabeçalho"""
+    if profiler.should_profile(request.headers):
+        g.profile_capture = profiler.start(f'{request.method} {request.path}')
+
+
+def _finish_capture(capture, status: int):
+    try:
+        profiler.finish(capture, status)
+    except Exception as e:
+        print(f"Erro ao gravar perfil: {e}")
+
+
+@app.after_request
+def finish_profile(response):
+    capture = g.pop('profile_capture', None)
+    if capture is not None:
+        response.headers['X-Profile-Id'] = capture.id
+        if response.is_streamed:
+            # Respostas em streaming (/extract-batch) são geradas depois deste
+            # hook, na mesma thread; a captura só termina quando o corpo acabar
+            status = response.status_code
+            response.call_on_close(lambda: _finish_capture(capture, status))
+        else:
+            _finish_capture(capture, response.status_code)
+    return response
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Capturas de perfil recentes (exige X-Admin-Token)"""
+    if not profiler.is_admin(request.headers):
+        return jsonify({'error': 'Acesso negado'}), 403
+    return jsonify({
+        'success': True,
+        'sample_rate': profiler.sample_rate,
+        'profiles': profiler.list_captures()
+    })
+
+
+@app.route('/admin/profiles/<capture_id>.<kind>', methods=['GET'])
+def download_profile(capture_id, kind):
+    """Arquivo de uma captura: svg (flamegraph), folded ou pstats"""
+    if not profiler.is_admin(request.headers):
+        return jsonify({'error': 'Acesso negado'}), 403
+    path = profiler.capture_path(capture_id, kind)
+    if not path:
+        return jsonify({'error': 'Captura não encontrada'}), 404
+    mimetypes = {'svg': 'image/svg+xml', 'folded': 'text/plain', 'pstats': 'application/octet-stream'}
+    return send_file(path, mimetype=mimetypes[kind], as_attachment=kind == 'pstats')
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'ok',
         'service': 'invoice-extractor',
-        'supabase_connected': supabase is not None
+        'supabase_connected': bool(SUPABASE_URL and SUPABASE_KEY)
+    })
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness: 200 apenas após o aquecimento (modelos e dependências carregados)
+    
+    A primeira chamada dispara o aquecimento, caso ainda não tenha começado
+    (ex.: quando o app é servido por gunicorn).
+    """
+    start_warm_up()
+    ready = _ready.is_set()
+    return jsonify({
+        'ready': ready,
+        'pid': os.getpid(),
+        'timings': startup_timings
+    }), 200 if ready else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas internas do serviço"""
+    return jsonify({
+        'admission': admission.metrics(),
+        'conversion_pool': conversion_pool.metrics() if conversion_pool else None,
+        'match_cache': match_cache.stats()
     })
 
 
@@ -96,7 +450,7 @@ def extract_invoice():
     - multipart/form-data com arquivo PDF
     - application/json com texto ou base64
     """
-    extractor = InvoiceExtractor()
+    extractor = InvoiceExtractor(markdown_store=markdown_store, conversion_pool=conversion_pool)
     
     try:
         # Verificar se é upload de arquivo
@@ -108,8 +462,10 @@ def extract_invoice():
             # Salvar temporariamente
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
                 file.save(tmp.name)
-                extracted = extractor.extract_from_pdf(tmp.name)
-                os.unlink(tmp.name)
+                try:
+                    extracted = extract_pdf(extractor, tmp.name, source_name=file.filename)
+                finally:
+                    os.unlink(tmp.name)
         
         # Verificar se é JSON com texto
         elif request.is_json:
@@ -123,8 +479,10 @@ def extract_invoice():
                 with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
                     tmp.write(pdf_bytes)
                     tmp.flush()
-                    extracted = extractor.extract_from_pdf(tmp.name)
-                    os.unlink(tmp.name)
+                    try:
+                        extracted = extract_pdf(extractor, tmp.name)
+                    finally:
+                        os.unlink(tmp.name)
             else:
                 return jsonify({'error': 'Envie text ou base64 no JSON'}), 400
         else:
@@ -135,6 +493,167 @@ def extract_invoice():
             'data': asdict(extracted)
         })
         
+    except AdmissionRejected as e:
+        return rejected_response(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/extract-batch', methods=['POST'])
+def extract_batch():
+    """
+    Extrai dados de muitos textos em uma única chamada
+    
+    Body JSON:
+    {
+        "texts": ["texto 1", "texto 2", ...]
+    }
+    
+    Resposta em NDJSON (application/x-ndjson), na ordem da entrada:
+    {"index": 0, "data": { ... }}
+    """
+    data = request.get_json(silent=True) or {}
+    texts = data.get('texts')
+    
+    if not isinstance(texts, list) or not texts:
+        return jsonify({'error': 'Envie texts como lista não vazia'}), 400
+    if len(texts) > EXTRACT_BATCH_MAX_TEXTS:
+        return jsonify({'error': f'Máximo de {EXTRACT_BATCH_MAX_TEXTS} textos por chamada'}), 400
+    if not all(isinstance(text, str) for text in texts):
+        return jsonify({'error': 'Todos os itens de texts devem ser strings'}), 400
+    
+    chunksize = data.get('chunksize')
+    if chunksize is None:
+        chunksize = 64
+    if isinstance(chunksize, bool) or not isinstance(chunksize, int) or chunksize < 1:
+        return jsonify({'error': 'chunksize deve ser um inteiro positivo'}), 400
+    
+    def generate():
+        pool = get_text_pool()
+        try:
+            results = extract_from_texts(
+                texts, workers=TEXT_EXTRACTION_WORKERS,
+                chunksize=chunksize, pool=pool
+            )
+            for index, extracted in enumerate(results):
+                yield json.dumps({'index': index, 'data': asdict(extracted)}, ensure_ascii=False) + '\n'
+        except BrokenProcessPool as e:
+            discard_text_pool(pool)
+            yield json.dumps({'success': False, 'error': str(e)}, ensure_ascii=False) + '\n'
+        except Exception as e:
+            yield json.dumps({'success': False, 'error': str(e)}, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/extract-segments', methods=['POST'])
+def extract_segments():
+    """
+    Extrai um registro por boleto/página de carnês e extratos com vários documentos
+    
+    Aceita:
+    - multipart/form-data com arquivo PDF (campos opcionais: mode, company_id, filters em JSON)
+    - application/json com text ou base64 (e os mesmos campos opcionais)
+    
+    mode: 'auto' (padrão), 'boleto' ou 'page'. Com company_id, todos os
+    segmentos são cruzados com os payables em uma única varredura.
+    """
+    extractor = InvoiceExtractor(markdown_store=markdown_store, conversion_pool=conversion_pool)
+    
+    try:
+        if 'file' in request.files:
+            params = request.form
+            try:
+                filters = json.loads(params.get('filters') or '{}')
+            except ValueError:
+                return jsonify({'error': 'filters deve ser um objeto JSON'}), 400
+        elif request.is_json:
+            params = request.get_json()
+            filters = params.get('filters') or {}
+        else:
+            return jsonify({'error': 'Envie um arquivo PDF ou JSON com texto/base64'}), 400
+        if not isinstance(filters, dict):
+            return jsonify({'error': 'filters deve ser um objeto JSON'}), 400
+        
+        mode = params.get('mode') or 'auto'
+        if mode not in SEGMENT_MODES:
+            return jsonify({'error': f'mode deve ser um de: {", ".join(SEGMENT_MODES)}'}), 400
+        company_id = params.get('company_id')
+        
+        if 'file' in request.files:
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
+                file.save(tmp.name)
+                try:
+                    segments = extract_pdf_segments(extractor, tmp.name, mode, source_name=file.filename)
+                finally:
+                    os.unlink(tmp.name)
+        elif 'text' in params:
+            segments = list(extractor.extract_segments(params['text'], mode))
+        elif 'base64' in params:
+            import base64
+            pdf_bytes = base64.b64decode(params['base64'])
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
+                tmp.write(pdf_bytes)
+                tmp.flush()
+                try:
+                    segments = extract_pdf_segments(extractor, tmp.name, mode)
+                finally:
+                    os.unlink(tmp.name)
+        else:
+            return jsonify({'error': 'Envie text ou base64 no JSON'}), 400
+        
+        results = [{'data': asdict(extracted)} for extracted in segments]
+        
+        if company_id and segments:
+            snapshot = get_payables_snapshot(company_id, filters)
+            version = payables_versions.get(company_id)
+            if snapshot is not None:
+                version = (version, snapshot.generation)
+            
+            # Segmentos já cruzados (mesmos campos, mesma versão) vêm do cache
+            keys = [match_cache.make_key(company_id, filters, extracted, version) for extracted in segments]
+            pending = []
+            for index, key in enumerate(keys):
+                cached = match_cache.get(key)
+                if cached is not None:
+                    results[index]['match'] = dict(cached, extracted_data=results[index]['data'])
+                else:
+                    pending.append(index)
+            
+            if pending:
+                payables = snapshot if snapshot is not None else get_payables_for_matching(company_id, filters)
+                if payables:
+                    matcher = PayableMatcher(payables)
+                    matched = matcher.find_matches_many([segments[index] for index in pending])
+                    for index, result in zip(pending, matched):
+                        match_cache.put(keys[index], result)
+                        results[index]['match'] = result
+                else:
+                    for index in pending:
+                        results[index]['match'] = {
+                            'exact_matches': [],
+                            'partial_matches': [],
+                            'suggested_action': 'CRIAR_NOVO_LANCAMENTO',
+                            'extracted_data': results[index]['data'],
+                            'total_payables_checked': 0,
+                            'message': 'Nenhuma conta a pagar encontrada para cruzamento'
+                        }
+        
+        return jsonify({
+            'success': True,
+            'mode': mode,
+            'total_segments': len(results),
+            'segments': results
+        })
+        
+    except AdmissionRejected as e:
+        return rejected_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -173,22 +692,40 @@ def match_with_payables():
             extracted_dict = data['extracted_data']
             extracted = ExtractedInvoiceData(**extracted_dict)
         elif 'text' in data:
-            extractor = InvoiceExtractor()
+            extractor = InvoiceExtractor(markdown_store=markdown_store, conversion_pool=conversion_pool)
             extracted = extractor.extract_from_text(data['text'])
         elif 'base64' in data:
             import base64
-            extractor = InvoiceExtractor()
+            extractor = InvoiceExtractor(markdown_store=markdown_store, conversion_pool=conversion_pool)
             pdf_bytes = base64.b64decode(data['base64'])
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
                 tmp.write(pdf_bytes)
                 tmp.flush()
-                extracted = extractor.extract_from_pdf(tmp.name)
-                os.unlink(tmp.name)
+                try:
+                    extracted = extract_pdf(extractor, tmp.name)
+                finally:
+                    os.unlink(tmp.name)
         else:
             return jsonify({'error': 'Envie extracted_data, text ou base64'}), 400
         
-        # Buscar payables do banco
-        payables = get_payables_for_matching(company_id, filters)
+        # Snapshot compartilhado; sua geração também entra na versão do cache,
+        # pois é visível a todos os processos
+        snapshot = get_payables_snapshot(company_id, filters)
+        version = payables_versions.get(company_id)
+        if snapshot is not None:
+            version = (version, snapshot.generation)
+        
+        # Resultado em cache para os mesmos dados e a mesma versão dos payables
+        cache_key = match_cache.make_key(company_id, filters, extracted, version)
+        cached = match_cache.get(cache_key)
+        if cached is not None:
+            return jsonify({
+                'success': True,
+                'data': dict(cached, extracted_data=asdict(extracted))
+            })
+        
+        # Buscar payables do banco (ou usar o snapshot compartilhado)
+        payables = snapshot if snapshot is not None else get_payables_for_matching(company_id, filters)
         
         if not payables:
             return jsonify({
@@ -206,12 +743,15 @@ def match_with_payables():
         # Fazer o cruzamento
         matcher = PayableMatcher(payables)
         result = matcher.find_matches(extracted)
+        match_cache.put(cache_key, result)
         
         return jsonify({
             'success': True,
             'data': result
         })
         
+    except AdmissionRejected as e:
+        return rejected_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -234,6 +774,7 @@ def reconcile_payable():
     try:
         data = request.get_json()
         
+        supabase = get_supabase()
         if not supabase:
             return jsonify({'error': 'Supabase não configurado'}), 500
         
@@ -271,6 +812,9 @@ def reconcile_payable():
         # Atualizar no banco
         supabase.table('payables').update(update_data).eq('id', payable_id).execute()
         
+        # Resultados de /match em cache para a empresa deixam de valer
+        invalidate_payables(payable['company_id'])
+        
         # Registrar no audit_log
         supabase.table('audit_logs').insert({
             'company_id': payable['company_id'],
@@ -298,6 +842,39 @@ def reconcile_payable():
         }), 500
 
 
+@app.route('/payables/changed', methods=['POST'])
+def payables_changed():
+    """
+    Notifica alteração nos payables de uma empresa (invalida o cache do /match)
+    
+    Body JSON:
+    {
+        "company_id": "uuid"
+    }
+    Também aceita o payload de Database Webhooks do Supabase
+    (record / old_record com company_id).
+    
+    Exige o cabeçalho X-Webhook-Secret igual a PAYABLES_WEBHOOK_SECRET
+    (sem o segredo configurado, o endpoint recusa todas as chamadas).
+    """
+    secret = request.headers.get('X-Webhook-Secret') or ''
+    if not (PAYABLES_WEBHOOK_SECRET and hmac.compare_digest(secret, PAYABLES_WEBHOOK_SECRET)):
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    record = data.get('record') or data.get('old_record') or {}
+    company_id = data.get('company_id') or record.get('company_id')
+    
+    if not company_id:
+        return jsonify({'error': 'company_id é obrigatório'}), 400
+    
+    return jsonify({
+        'success': True,
+        'company_id': company_id,
+        'payables_version': invalidate_payables(company_id)
+    })
+
+
 @app.route('/analyze-batch', methods=['POST'])
 def analyze_batch():
     """
@@ -312,7 +889,7 @@ def analyze_batch():
         files = request.files.getlist('files')
         company_id = request.form.get('company_id')
         
-        extractor = InvoiceExtractor()
+        extractor = InvoiceExtractor(markdown_store=markdown_store, conversion_pool=conversion_pool)
         results = []
         
         for file in files:
@@ -321,8 +898,10 @@ def analyze_batch():
             
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
                 file.save(tmp.name)
-                extracted = extractor.extract_from_pdf(tmp.name)
-                os.unlink(tmp.name)
+                try:
+                    extracted = extract_pdf(extractor, tmp.name, source_name=file.filename)
+                finally:
+                    os.unlink(tmp.name)
                 
                 result = {
                     'filename': file.filename,
@@ -331,7 +910,9 @@ def analyze_batch():
                 
                 # Se tem company_id, fazer cruzamento
                 if company_id:
-                    payables = get_payables_for_matching(company_id)
+                    payables = get_payables_snapshot(company_id)
+                    if payables is None:
+                        payables = get_payables_for_matching(company_id)
                     if payables:
                         matcher = PayableMatcher(payables)
                         match_result = matcher.find_matches(extracted)
@@ -354,6 +935,8 @@ def analyze_batch():
             'results': results
         })
         
+    except AdmissionRejected as e:
+        return rejected_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -361,6 +944,159 @@ def analyze_batch():
         }), 500
 
 
+startup_timings['import_s'] = round(time.perf_counter() - _import_started, 3)
+
+
+def _shutdown_process_resources():
+    """Encerra pools do processo (workers forkados saem via os._exit)"""
+    if conversion_pool is not None:
+        conversion_pool.shutdown()
+    if _text_pool is not None:
+        _text_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def split_conversion_budget(workers: int):
+    """
+    Divide entre os processos HTTP o orçamento de admissão e os workers de
+    conversão e de extração de texto, que são configurados para a máquina inteira
+    """
+    global TEXT_EXTRACTION_WORKERS
+    TEXT_EXTRACTION_WORKERS = max(1, TEXT_EXTRACTION_WORKERS // workers)
+    admission.max_concurrent = max(1, admission.max_concurrent // workers)
+    admission.max_queue = max(1, admission.max_queue // workers)
+    admission.memory_budget_mb = admission.memory_budget_mb / workers
+    if conversion_pool is not None:
+        conversion_pool.workers = max(1, conversion_pool.workers // workers)
+    print(f"Por processo HTTP: {admission.max_concurrent} conversões simultâneas, "
+          f"{admission.memory_budget_mb:.0f} MB de orçamento"
+          + (f", {conversion_pool.workers} workers de conversão" if conversion_pool is not None else '')
+          + f", {TEXT_EXTRACTION_WORKERS} workers de extração de texto")
+
+
+def serve_preforked(host: str, port: int, workers: int):
+    """
+    Modo preload-then-fork: carrega os modelos uma vez no processo pai e cria
+    os workers HTTP por fork, compartilhando a memória em copy-on-write
+    """
+    import gc
+    import signal
+    import socket
+    from werkzeug.serving import make_server
+    
+    if workers > 1 and conversion_pool is not None and conversion_pool.start_method != 'forkserver':
+        # Em 'spawn', cada worker de conversão carregaria sua própria cópia dos
+        # modelos; em 'fork', os substitutos sairiam por fork de threads de
+        # requisição do servidor HTTP, com locks e pools de threads (torch) herdados
+        raise SystemExit(
+            'Com --workers > 1, use CONVERSION_START_METHOD=forkserver (workers de conversão '
+            'nascem de um forkserver com os modelos pré-carregados) ou CONVERSION_WORKERS=0 '
+            '(conversão no processo HTTP)'
+        )
+    split_conversion_budget(workers)
+    
+    if WARM_UP_MODELS:
+        started = time.perf_counter()
+        preload_models()
+        startup_timings['preload_s'] = round(time.perf_counter() - started, 3)
+        print(f"Pré-carregamento no processo pai: {json.dumps(startup_timings)}")
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    
+    # Objetos do pai fora do GC: evita que coletas nos filhos sujem as páginas compartilhadas
+    gc.freeze()
+    
+    children = {}
+    stopping = False
+    # Filhos que morrem logo após iniciar (ex.: erro de configuração) são
+    # recriados com espera exponencial, em vez de um laço de fork
+    min_uptime = 30.0
+    max_backoff = 60.0
+    quick_exits = 0
+    
+    def spawn():
+        pid = os.fork()
+        if pid:
+            children[pid] = time.monotonic()
+            return
+        
+        # Processo filho
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        signal.signal(signal.SIGINT, lambda *_: sys.exit(0))
+        code = 0
+        try:
+            start_warm_up(load_models=False)
+            make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+        except SystemExit:
+            pass
+        except Exception as e:
+            print(f"[{os.getpid()}] Worker encerrado com erro: {e}")
+            code = 1
+        finally:
+            _shutdown_process_resources()
+            os._exit(code)
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    
+    for _ in range(workers):
+        spawn()
+    print(f"Servindo em http://{host}:{port} com {workers} workers (pid pai {os.getpid()})")
+    
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if stopping:
+            continue
+        
+        if started is not None and time.monotonic() - started < min_uptime:
+            quick_exits += 1
+        else:
+            quick_exits = 0
+        delay = min(max_backoff, 2 ** (quick_exits - 1)) if quick_exits else 0
+        print(f"Worker {pid} saiu (status {status}); iniciando substituto"
+              + (f" em {delay:.0f}s" if delay else ''))
+        
+        deadline = time.monotonic() + delay
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(min(0.5, deadline - time.monotonic()))
+        if not stopping:
+            spawn()
+
+
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='API de extração e cruzamento de faturas')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 1)),
+                        help='Processos HTTP (modo preload-then-fork quando > 1)')
+    parser.add_argument('--preload', action='store_true',
+                        help='Carrega os modelos no processo pai e cria os workers por fork')
+    args = parser.parse_args()
+    
+    print(f"Imports concluídos em {startup_timings['import_s']:.3f}s")
+    
+    if args.preload or args.workers > 1:
+        serve_preforked(args.host, args.port, max(args.workers, 1))
+    else:
+        # Com o reloader do modo debug, só o processo que serve aquece
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_warm_up()
+        app.run(host=args.host, port=args.port, debug=True)
@@ -4,12 +4,66 @@ Invoice/Boleto Extractor using Docling
 Extrai dados de faturas e boletos em PDF e cruza com lançamentos financeiros
 """
 
+import os
 import re
 import json
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Optional, Dict, List, Any
+from itertools import islice
+from typing import Optional, Dict, List, Any, Iterable, Iterator, Tuple
 from dataclasses import dataclass, asdict
-from docling.document_converter import DocumentConverter
+from conversion_pool import ConversionTimeout
+
+
+# Versão das regras de extração (regex e heurísticas).
+# Incrementar sempre que self.patterns ou _extract_nomes forem alterados,
+# O reprocessamento (reprocess_markdown.py) pula os artefatos já gravados com
+# a versão atual e, com --write, regrava a versão de todos os que reprocessou.
+EXTRACTION_RULES_VERSION = 2
+
+
+# Marcador de quebra de página inserido no markdown exportado pelo Docling.
+# Permite segmentar o documento por página sem convertê-lo novamente.
+PAGE_BREAK = '<!-- page-break -->'
+
+SEGMENT_MODES = ('auto', 'page', 'boleto')
+
+
+# Conversor Docling compartilhado pelo processo. O import do Docling (torch,
+# modelos de layout) só acontece na primeira conversão ou no aquecimento.
+_document_converter = None
+_document_converter_lock = threading.Lock()
+
+
+def get_document_converter():
+    """DocumentConverter único do processo, criado no primeiro uso"""
+    global _document_converter
+    if _document_converter is None:
+        with _document_converter_lock:
+            if _document_converter is None:
+                from docling.document_converter import DocumentConverter
+                _document_converter = DocumentConverter()
+    return _document_converter
+
+
+def initialize_pdf_pipeline(converter):
+    """
+    Carrega o pipeline de PDF (modelos de layout) do conversor
+
+    O DocumentConverter só monta o pipeline na primeira conversão; chamar isto
+    antes de atender evita que o primeiro documento pague o carregamento.
+    """
+    if hasattr(converter, 'initialize_pipeline'):
+        from docling.datamodel.base_models import InputFormat
+        converter.initialize_pipeline(InputFormat.PDF)
+
+
+def export_markdown(document) -> str:
+    """Exporta um DoclingDocument em markdown, marcando as quebras de página"""
+    return document.export_to_markdown(page_break_placeholder=PAGE_BREAK)
 
 
 @dataclass
@@ -42,6 +96,10 @@ class ExtractedInvoiceData:
     numero_fatura: Optional[str] = None
     parcela: Optional[str] = None  # "1/3", "2/3", etc.
     
+    # Segmentação (carnês e extratos com vários documentos)
+    pagina: Optional[int] = None  # página onde o segmento começa (1 = primeira)
+    segmento: Optional[int] = None  # posição do segmento no arquivo (1 = primeiro)
+    
     # Metadados
     confidence_score: float = 0.0
     extraction_errors: List[str] = None
@@ -54,8 +112,17 @@ class ExtractedInvoiceData:
 class InvoiceExtractor:
     """Extrai dados de faturas e boletos usando Docling"""
     
-    def __init__(self):
-        self.converter = DocumentConverter()
+    def __init__(self, markdown_store=None, conversion_pool=None):
+        """
+        Args:
+            markdown_store: MarkdownStore opcional; quando informado, o markdown
+                            de cada PDF convertido é gravado para reprocessamento
+            conversion_pool: ConversionPool opcional; quando informado, a conversão
+                             roda em processos supervisionados com prazo máximo
+        """
+        self._converter = None
+        self.markdown_store = markdown_store
+        self.conversion_pool = conversion_pool
         
         # Padrões de regex para extração
         self.patterns = {
@@ -106,16 +173,34 @@ class InvoiceExtractor:
             ],
         }
     
-    def extract_from_pdf(self, pdf_path: str) -> ExtractedInvoiceData:
+    @property
+    def converter(self):
+        """Conversor Docling do processo, obtido apenas quando um PDF é processado"""
+        if self._converter is None:
+            self._converter = get_document_converter()
+        return self._converter
+    
+    def extract_from_pdf(self, pdf_path: str, source_name: Optional[str] = None) -> ExtractedInvoiceData:
         """Extrai dados de um arquivo PDF"""
         try:
             # Converter PDF para texto usando Docling
-            result = self.converter.convert(pdf_path)
-            text = result.document.export_to_markdown()
+            text = self._convert_to_markdown(pdf_path)
             
             # Extrair dados do texto
-            return self._extract_from_text(text)
+            extracted = self._extract_from_text(text)
+            
+            # Guardar o markdown para reprocessamentos futuros
+            if self.markdown_store is not None:
+                self._store_markdown(pdf_path, text, extracted, source_name)
             
+            return extracted
+            
+        except ConversionTimeout as e:
+            return ExtractedInvoiceData(
+                document_type='erro',
+                raw_text='',
+                extraction_errors=[f'Tempo limite de conversão excedido: {str(e)}']
+            )
         except Exception as e:
             return ExtractedInvoiceData(
                 document_type='erro',
@@ -123,13 +208,191 @@ class InvoiceExtractor:
                 extraction_errors=[f'Erro ao processar PDF: {str(e)}']
             )
     
+    def _convert_to_markdown(self, pdf_path: str) -> str:
+        """Converte o PDF em markdown (no pool supervisionado, se houver)"""
+        if self.conversion_pool is not None:
+            return self.conversion_pool.convert_to_markdown(pdf_path)
+        result = self.converter.convert(pdf_path)
+        return export_markdown(result.document)
+    
+    def _store_markdown(self, pdf_path: str, text: str, extracted: ExtractedInvoiceData,
+                        source_name: Optional[str]):
+        """Grava o markdown convertido; falhas não interrompem a extração"""
+        try:
+            self.markdown_store.save(
+                pdf_path, text, asdict(extracted),
+                rules_version=EXTRACTION_RULES_VERSION,
+                source_name=source_name
+            )
+        except Exception as e:
+            print(f"Erro ao gravar markdown: {e}")
+    
     def extract_from_text(self, text: str) -> ExtractedInvoiceData:
         """Extrai dados de um texto já convertido"""
         return self._extract_from_text(text)
     
+    def extract_segments_from_pdf(self, pdf_path: str, mode: str = 'auto',
+                                  source_name: Optional[str] = None) -> Iterator[ExtractedInvoiceData]:
+        """
+        Converte o PDF uma única vez e devolve um gerador com um registro por segmento
+        
+        A conversão acontece nesta chamada (não no primeiro next()), para que o
+        chamador possa limitá-la com o controle de admissão; a extração de cada
+        segmento só roda quando o gerador é consumido.
+        """
+        try:
+            text = self._convert_to_markdown(pdf_path)
+        except ConversionTimeout as e:
+            return iter([ExtractedInvoiceData(
+                document_type='erro',
+                raw_text='',
+                extraction_errors=[f'Tempo limite de conversão excedido: {str(e)}']
+            )])
+        except Exception as e:
+            return iter([ExtractedInvoiceData(
+                document_type='erro',
+                raw_text='',
+                extraction_errors=[f'Erro ao processar PDF: {str(e)}']
+            )])
+        
+        # O artefato guardado continua com a extração do documento inteiro,
+        # que é o que o reprocessamento compara
+        if self.markdown_store is not None:
+            self._store_markdown(pdf_path, text, self._extract_from_text(text), source_name)
+        
+        return self.extract_segments(text, mode)
+    
+    def extract_segments(self, text: str, mode: str = 'auto') -> Iterator[ExtractedInvoiceData]:
+        """
+        Extrai um registro por segmento de um texto já convertido
+        
+        Args:
+            text: markdown (com marcadores PAGE_BREAK, quando houver)
+            mode: 'page' (um segmento por página), 'boleto' (um segmento por
+                  linha digitável distinta) ou 'auto' (por boleto quando houver
+                  mais de uma linha digitável; senão, o documento inteiro)
+        """
+        for number, (page, segment_text) in enumerate(self.split_segments(text, mode), start=1):
+            extracted = self._extract_from_text(segment_text)
+            extracted.pagina = page
+            extracted.segmento = number
+            yield extracted
+    
+    def split_segments(self, text: str, mode: str = 'auto') -> Iterator[Tuple[int, str]]:
+        """
+        Divide o texto em segmentos, gerando (página inicial, texto do segmento)
+        
+        Por boleto, as quebras de página são os cortes preferidos: uma página com
+        uma única linha digitável é um segmento inteiro. Só páginas com mais de
+        uma linha digitável são cortadas, entre linhas consecutivas. Páginas sem
+        linha digitável (detalhamento, capa) acompanham o próximo boleto.
+        """
+        if mode not in SEGMENT_MODES:
+            raise ValueError(f'Modo de segmentação inválido: {mode}')
+        
+        pages = text.split(PAGE_BREAK)
+        
+        if mode == 'page':
+            for page, page_text in enumerate(pages, start=1):
+                if page_text.strip():
+                    yield page, page_text
+            return
+        
+        # Trechos (página, texto, linha digitável ou None), na ordem do documento
+        pieces = []
+        for page_index, page_text in enumerate(pages):
+            groups = self._linha_groups(page_text)
+            if len(groups) <= 1:
+                pieces.append((page_index, page_text, groups[0][0] if groups else None))
+                continue
+            for start, end, key in self._page_cuts(page_text, groups):
+                pieces.append((page_index, page_text[start:end], key))
+        
+        keys = {key for _, _, key in pieces if key is not None}
+        if mode == 'auto' and len(keys) < 2:
+            yield 1, text
+            return
+        
+        segments = []  # [página, [textos], linha digitável]
+        pending = []
+        for page_index, piece_text, key in pieces:
+            if key is None:
+                pending.append((page_index, piece_text))
+            elif segments and segments[-1][2] == key:
+                # Mesma linha repetida (recibo do pagador e ficha de compensação)
+                segments[-1][1].extend(t for _, t in pending)
+                segments[-1][1].append(piece_text)
+                pending = []
+            else:
+                first_page = pending[0][0] if pending else page_index
+                segments.append([first_page, [t for _, t in pending] + [piece_text], key])
+                pending = []
+        
+        if pending:
+            if segments:
+                segments[-1][1].extend(t for _, t in pending)
+            else:
+                segments.append([pending[0][0], [t for _, t in pending], None])
+        
+        for page_index, parts, _ in segments:
+            segment_text = '\n'.join(parts)
+            if segment_text.strip():
+                yield page_index + 1, segment_text
+    
+    def _linha_occurrences(self, text: str) -> List[Tuple[int, int, str]]:
+        """(início, fim, dígitos) de cada linha digitável / código de barras do texto"""
+        found = {}
+        for pattern in self.patterns['linha_digitavel'] + self.patterns['codigo_barras']:
+            for match in re.finditer(pattern, text):
+                if match.start() not in found:
+                    found[match.start()] = (match.start(), match.end(), re.sub(r'[^\d]', '', match.group(1)))
+        return [found[position] for position in sorted(found)]
+    
+    def _linha_groups(self, page_text: str) -> List[Tuple[str, int, int]]:
+        """
+        Linhas digitáveis distintas da página, na ordem da primeira ocorrência:
+        (dígitos, início da primeira ocorrência, fim da última ocorrência)
+        """
+        groups: Dict[str, list] = {}
+        for start, end, key in self._linha_occurrences(page_text):
+            if key in groups:
+                groups[key][2] = end
+            else:
+                groups[key] = [key, start, end]
+        return [tuple(group) for group in groups.values()]
+    
+    def _page_cuts(self, page_text: str, groups: List[tuple]) -> List[Tuple[int, int, str]]:
+        """
+        Corta uma página com vários boletos entre linhas digitáveis consecutivas
+        
+        Se os campos (valor, datas) vêm antes da primeira linha digitável, cada
+        boleto termina na linha do seu código; senão (ficha de compensação com
+        o código no topo), cada boleto começa na linha do seu código.
+        """
+        before = page_text[:groups[0][1]]
+        fields_first = any(
+            re.search(pattern, before)
+            for pattern in self.patterns['data'] + [self.patterns['valor'][1]]
+        )
+        
+        cuts = []
+        for current, following in zip(groups, groups[1:]):
+            next_line_start = page_text.rfind('\n', 0, following[1]) + 1
+            if fields_first:
+                line_end = page_text.find('\n', current[2])
+                line_end = len(page_text) if line_end == -1 else line_end + 1
+                # Ocorrências intercaladas: volta ao início da linha seguinte
+                cuts.append(line_end if line_end <= following[1] else next_line_start)
+            else:
+                cuts.append(next_line_start)
+        
+        bounds = [0] + cuts + [len(page_text)]
+        return [(bounds[i], bounds[i + 1], group[0]) for i, group in enumerate(groups)]
+    
     def _extract_from_text(self, text: str) -> ExtractedInvoiceData:
         """Lógica principal de extração"""
         errors = []
+        text = text.replace(PAGE_BREAK, '\n')
         text_lower = text.lower()
         
         # Detectar tipo de documento
@@ -244,6 +507,9 @@ class InvoiceExtractor:
     
     def _extract_cnpjs(self, text: str) -> List[str]:
         """Extrai CNPJs do documento"""
+        # O último campo da linha digitável tem 14 dígitos e passaria por CNPJ
+        for start, end, _ in reversed(self._linha_occurrences(text)):
+            text = text[:start] + ' ' * (end - start) + text[end:]
         cnpjs = []
         for pattern in self.patterns['cnpj']:
             matches = re.findall(pattern, text)
@@ -327,15 +593,35 @@ class InvoiceExtractor:
 class PayableMatcher:
     """Cruza dados extraídos com lançamentos financeiros"""
     
+    # Campos de ExtractedInvoiceData usados na pontuação
+    SCORING_FIELDS = ('beneficiario_cnpj', 'valor_total', 'data_vencimento', 'numero_documento')
+    
     def __init__(self, payables: List[Dict[str, Any]]):
         """
         Args:
             payables: Lista de contas a pagar do banco de dados
                       Cada item deve ter: id, supplier_id, amount, due_date, 
                       document_number, supplier_cnpj, supplier_name
+                      Também aceita um PayablesView (snapshot colunar
+                      compartilhado), lido sem materializar os dicts
         """
         self.payables = payables
     
+    def _scoring_rows(self):
+        """(referência, cnpj, valor, vencimento, nº documento) de cada payable"""
+        if hasattr(self.payables, 'scoring_rows'):
+            return self.payables.scoring_rows()
+        return (
+            (p, p.get('supplier_cnpj'), p.get('amount'), p.get('due_date'), p.get('document_number'))
+            for p in self.payables
+        )
+    
+    def _payable(self, ref) -> Dict[str, Any]:
+        """Payable completo a partir da referência de _scoring_rows"""
+        if hasattr(self.payables, 'payable'):
+            return self.payables.payable(ref)
+        return ref
+    
     def find_matches(self, extracted: ExtractedInvoiceData) -> Dict[str, Any]:
         """
         Encontra lançamentos que correspondem aos dados extraídos
@@ -347,76 +633,102 @@ class PayableMatcher:
                 - suggested_action: ação sugerida
                 - divergences: divergências encontradas
         """
-        exact_matches = []
-        partial_matches = []
-        divergences = []
-        
-        for payable in self.payables:
-            match_score = 0
-            match_details = []
-            divergence_details = []
-            
-            # 1. Comparar CNPJ do fornecedor
-            if extracted.beneficiario_cnpj and payable.get('supplier_cnpj'):
-                cnpj_payable = re.sub(r'[^\d]', '', payable['supplier_cnpj'])
-                if extracted.beneficiario_cnpj == cnpj_payable:
-                    match_score += 40
-                    match_details.append('CNPJ do fornecedor confere')
-            
-            # 2. Comparar valor
-            if extracted.valor_total and payable.get('amount'):
-                diff = abs(extracted.valor_total - float(payable['amount']))
-                if diff < 0.01:
-                    match_score += 30
-                    match_details.append('Valor exato')
-                elif diff < 1.0:
-                    match_score += 20
-                    match_details.append(f'Valor aproximado (diff: R$ {diff:.2f})')
-                elif diff / float(payable['amount']) < 0.05:  # 5% de diferença
-                    match_score += 10
-                    match_details.append(f'Valor com pequena divergência ({diff:.2f})')
-                    divergence_details.append({
-                        'field': 'valor',
-                        'expected': payable['amount'],
-                        'found': extracted.valor_total,
-                        'difference': diff
-                    })
+        return self.find_matches_many([extracted])[0]
+    
+    def find_matches_many(self, extracted_list: List[ExtractedInvoiceData]) -> List[Dict[str, Any]]:
+        """
+        Cruza vários registros (ex.: segmentos de um carnê) em uma única
+        varredura dos payables
+        
+        Returns:
+            Um resultado no formato de find_matches para cada registro, na mesma ordem
+        """
+        exact_matches = [[] for _ in extracted_list]
+        partial_matches = [[] for _ in extracted_list]
+        
+        for ref, supplier_cnpj, amount, due_date, document_number in self._scoring_rows():
+            cnpj_payable = re.sub(r'[^\d]', '', supplier_cnpj) if supplier_cnpj else None
             
-            # 3. Comparar data de vencimento
-            if extracted.data_vencimento and payable.get('due_date'):
-                due_date_payable = str(payable['due_date'])[:10]
-                if extracted.data_vencimento == due_date_payable:
-                    match_score += 20
-                    match_details.append('Data de vencimento confere')
+            for index, extracted in enumerate(extracted_list):
+                match_score, match_details, divergence_details = self._score(
+                    extracted, cnpj_payable, amount, due_date, document_number
+                )
+                
+                # Classificar match
+                if match_score >= 70:
+                    target = exact_matches[index]
+                elif match_score >= 40:
+                    target = partial_matches[index]
                 else:
-                    divergence_details.append({
-                        'field': 'vencimento',
-                        'expected': due_date_payable,
-                        'found': extracted.data_vencimento
-                    })
-            
-            # 4. Comparar número do documento
-            if extracted.numero_documento and payable.get('document_number'):
-                if extracted.numero_documento in str(payable['document_number']):
-                    match_score += 10
-                    match_details.append('Número do documento confere')
-            
-            # Classificar match
-            if match_score >= 70:
-                exact_matches.append({
-                    'payable': payable,
+                    continue
+                target.append({
+                    'payable': self._payable(ref),
                     'score': match_score,
                     'details': match_details,
                     'divergences': divergence_details
                 })
-            elif match_score >= 40:
-                partial_matches.append({
-                    'payable': payable,
-                    'score': match_score,
-                    'details': match_details,
-                    'divergences': divergence_details
+        
+        return [
+            self._build_result(extracted, exact_matches[index], partial_matches[index])
+            for index, extracted in enumerate(extracted_list)
+        ]
+    
+    @staticmethod
+    def _score(extracted: ExtractedInvoiceData, cnpj_payable: Optional[str], amount,
+               due_date, document_number) -> tuple:
+        """Pontua um payable contra um registro: (score, detalhes, divergências)"""
+        match_score = 0
+        match_details = []
+        divergence_details = []
+        
+        # 1. Comparar CNPJ do fornecedor
+        if extracted.beneficiario_cnpj and cnpj_payable is not None:
+            if extracted.beneficiario_cnpj == cnpj_payable:
+                match_score += 40
+                match_details.append('CNPJ do fornecedor confere')
+        
+        # 2. Comparar valor
+        if extracted.valor_total and amount:
+            diff = abs(extracted.valor_total - float(amount))
+            if diff < 0.01:
+                match_score += 30
+                match_details.append('Valor exato')
+            elif diff < 1.0:
+                match_score += 20
+                match_details.append(f'Valor aproximado (diff: R$ {diff:.2f})')
+            elif diff / float(amount) < 0.05:  # 5% de diferença
+                match_score += 10
+                match_details.append(f'Valor com pequena divergência ({diff:.2f})')
+                divergence_details.append({
+                    'field': 'valor',
+                    'expected': amount,
+                    'found': extracted.valor_total,
+                    'difference': diff
                 })
         
+        # 3. Comparar data de vencimento
+        if extracted.data_vencimento and due_date:
+            due_date_payable = str(due_date)[:10]
+            if extracted.data_vencimento == due_date_payable:
+                match_score += 20
+                match_details.append('Data de vencimento confere')
+            else:
+                divergence_details.append({
+                    'field': 'vencimento',
+                    'expected': due_date_payable,
+                    'found': extracted.data_vencimento
+                })
+        
+        # 4. Comparar número do documento
+        if extracted.numero_documento and document_number:
+            if extracted.numero_documento in str(document_number):
+                match_score += 10
+                match_details.append('Número do documento confere')
+        
+        return match_score, match_details, divergence_details
+    
+    def _build_result(self, extracted: ExtractedInvoiceData, exact_matches: List[Dict[str, Any]],
+                      partial_matches: List[Dict[str, Any]]) -> Dict[str, Any]:
         # Ordenar por score
         exact_matches.sort(key=lambda x: x['score'], reverse=True)
         partial_matches.sort(key=lambda x: x['score'], reverse=True)
@@ -463,6 +775,70 @@ def process_invoice_and_match(pdf_path: str, payables: List[Dict]) -> Dict[str,
     return result
 
 
+# Extrator de cada processo do pool de textos (criado uma vez por processo)
+_text_worker_extractor: Optional[InvoiceExtractor] = None
+
+
+def _init_text_worker():
+    global _text_worker_extractor
+    _text_worker_extractor = InvoiceExtractor()
+
+
+def _extract_text_chunk(texts: List[str]) -> List[ExtractedInvoiceData]:
+    return [_text_worker_extractor.extract_from_text(text) for text in texts]
+
+
+def create_text_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Pool de processos para extract_from_texts, reaproveitável entre chamadas
+    
+    Usa 'forkserver': o pool costuma ser criado dentro de um servidor com
+    várias threads, e um fork direto herdaria locks presos por elas.
+    """
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context('forkserver'),
+                               initializer=_init_text_worker)
+
+
+def extract_from_texts(texts: Iterable[str], workers: Optional[int] = None,
+                       chunksize: int = 64, pool: Optional[ProcessPoolExecutor] = None
+                       ) -> Iterator[ExtractedInvoiceData]:
+    """
+    Extrai dados de muitos textos já convertidos, em paralelo
+    
+    Os textos são lidos sob demanda e enviados em blocos de `chunksize` a um pool
+    de processos; cada processo mantém um único InvoiceExtractor. Os resultados
+    saem na mesma ordem da entrada, com no máximo 2 blocos por worker em voo.
+    
+    Args:
+        texts: iterável de textos (e-mails, OCR, XML/CSV exportados...)
+        workers: processos do pool (define também quantos blocos ficam em voo)
+        chunksize: textos por bloco enviado a um processo
+        pool: pool de create_text_pool() reaproveitado entre chamadas
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = create_text_pool(workers)
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+    
+    iterator = iter(texts)
+    pending = deque()
+    try:
+        while True:
+            chunk = list(islice(iterator, chunksize))
+            if chunk:
+                pending.append(pool.submit(_extract_text_chunk, chunk))
+            if pending and (not chunk or len(pending) >= max_pending):
+                yield from pending.popleft().result()
+            elif not chunk:
+                break
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_pool:
+            pool.shutdown()
+
+
 # Exemplo de uso e teste
 if __name__ == '__main__':
     # Exemplo de payables do banco de dados
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Teste de carga ponta a ponta do invoice_api, totalmente offline
+Sobe um PostgREST falso com empresas e payables sintéticos, inicia a API
+apontando para ele e dispara uma mistura de /extract, /match, /reconcile e
+/analyze-batch em cada nível de concorrência. O relatório sai em JSON.
+
+Uso:
+    python loadtest.py --tenants 5 --payables 5000 --concurrency 1,4,16 --duration 30
+    python loadtest.py --mix extract=5,match=5,reconcile=1,analyze-batch=1 --output carga.json
+
+/analyze-batch converte PDFs com o Docling (modelos baixados no primeiro uso),
+por isso fica fora da mistura padrão; inclua-o no --mix com os modelos em cache.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+
+from fake_postgrest import FakeDatabase, FAKE_SERVICE_KEY, start_server
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MIX = 'extract=4,match=4,reconcile=1,analyze-batch=0'
+
+# Prefixos de extraction_errors gerados quando a conversão do PDF falha
+CONVERSION_ERROR_PREFIXES = ('Erro ao processar PDF', 'Tempo limite de conversão')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _boleto_text(payable: Dict[str, Any], supplier: Dict[str, Any]) -> str:
+    """Texto de boleto coerente com um payable do banco falso"""
+    due = payable['due_date']
+    valor = f"{payable['amount']:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+    return (
+        'BOLETO BANCÁRIO\n\n'
+        f"Beneficiário: {supplier['razao_social']}\n"
+        f"CNPJ: {supplier['cpf_cnpj']}\n\n"
+        'Pagador: Minha Empresa\n'
+        'CNPJ: 11.222.333/0001-44\n\n'
+        f'Valor: R$ {valor}\n'
+        f'Vencimento: {due[8:10]}/{due[5:7]}/{due[0:4]}\n\n'
+        f"Nosso Número: {payable['document_number']}\n"
+        'Código de Barras: 23793.38128 60000.000003 00000.000401 1 84340000150000\n'
+    )
+
+
+def _simple_pdf(text: str) -> bytes:
+    """PDF mínimo de uma página com o texto informado"""
+    lines = [line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+             for line in text.encode('latin-1', 'replace').decode('latin-1').splitlines()]
+    stream = 'BT /F1 10 Tf 40 800 Td 12 TL ' + ' '.join(f'({line}) Tj T*' for line in lines) + ' ET'
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+        '/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>',
+        f'<< /Length {len(stream.encode("latin-1"))} >>\nstream\n{stream}\nendstream',
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    for offset in offsets:
+        out += f'{offset:010d} 00000 n \n'.encode('latin-1')
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    return bytes(out)
+
+
+def _multipart(fields: Dict[str, str], files: List[tuple]) -> tuple:
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in fields.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                 f'{value}\r\n').encode('utf-8')
+    for name, filename, content in files:
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                 f'filename="{filename}"\r\nContent-Type: application/pdf\r\n\r\n').encode('utf-8')
+        body += content + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode('utf-8')
+    return bytes(body), f'multipart/form-data; boundary={boundary}'
+
+
+class TrafficGenerator:
+    """Monta requisições realistas a partir dos dados do banco falso"""
+
+    def __init__(self, db: FakeDatabase, mix: Dict[str, float], seed: int = 7):
+        self.db = db
+        self.endpoints = [name for name, weight in mix.items() if weight > 0]
+        self.weights = [mix[name] for name in self.endpoints]
+        self._local = threading.local()
+        self._seed = seed
+        self._pessoas = {p['id']: p for p in db.tables['pessoas']}
+        self._payables = {cid: db.payables_for(cid) for cid in db.company_ids}
+
+    def _rng(self) -> random.Random:
+        if not hasattr(self._local, 'rng'):
+            self._local.rng = random.Random(f'{self._seed}-{threading.get_ident()}')
+        return self._local.rng
+
+    def next_request(self) -> tuple:
+        """(endpoint, body, content_type)"""
+        rng = self._rng()
+        endpoint = rng.choices(self.endpoints, self.weights)[0]
+        company_id = rng.choice(self.db.company_ids)
+        payable = rng.choice(self._payables[company_id])
+        text = _boleto_text(payable, self._pessoas[payable['supplier_id']])
+
+        if endpoint == 'extract':
+            return '/extract', json.dumps({'text': text}).encode('utf-8'), 'application/json'
+        if endpoint == 'match':
+            body = {'company_id': company_id, 'text': text}
+            return '/match', json.dumps(body).encode('utf-8'), 'application/json'
+        if endpoint == 'reconcile':
+            body = {'payable_id': payable['id'], 'action': 'confirm',
+                    'extracted_data': {'valor_total': payable['amount']}}
+            return '/reconcile', json.dumps(body).encode('utf-8'), 'application/json'
+        body, content_type = _multipart(
+            {'company_id': company_id},
+            [('files', f'boleto-{i}.pdf', _simple_pdf(text)) for i in range(rng.randint(1, 3))]
+        )
+        return '/analyze-batch', body, content_type
+
+
+def _conversion_failed(payload: Any) -> bool:
+    """
+    True se alguma extração da resposta falhou na conversão
+
+    A API responde 200 com document_type 'erro' nesses casos (/extract,
+    /analyze-batch), então o status HTTP sozinho não revela a falha.
+    """
+    if isinstance(payload, dict):
+        if payload.get('document_type') == 'erro':
+            return True
+        if any(str(error).startswith(CONVERSION_ERROR_PREFIXES)
+               for error in payload.get('extraction_errors') or []):
+            return True
+        return any(_conversion_failed(value) for value in payload.values()
+                   if isinstance(value, (dict, list)))
+    if isinstance(payload, list):
+        return any(_conversion_failed(item) for item in payload)
+    return False
+
+
+def _percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[index] * 1000, 2)
+
+
+def run_level(base_url: str, traffic: TrafficGenerator, concurrency: int,
+              duration: float, timeout: float) -> Dict[str, Any]:
+    """Executa um nível de concorrência e agrega latências por endpoint"""
+    samples = defaultdict(list)  # endpoint -> [(latência, status, falha de conversão)]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            path, body, content_type = traffic.next_request()
+            req = urllib.request.Request(base_url + path, data=body, method='POST',
+                                         headers={'Content-Type': content_type})
+            started = time.monotonic()
+            failed = False
+            try:
+                with urllib.request.urlopen(req, timeout=timeout) as resp:
+                    data = resp.read()
+                    status = resp.status
+                try:
+                    failed = _conversion_failed(json.loads(data))
+                except ValueError:
+                    failed = True
+            except urllib.error.HTTPError as e:
+                e.read()
+                status = e.code
+            except Exception:
+                status = 0
+            elapsed = time.monotonic() - started
+            with lock:
+                samples[path].append((elapsed, status, failed))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    wall = time.monotonic() - started
+
+    endpoints = {}
+    total = 0
+    total_errors = 0
+    for path, items in sorted(samples.items()):
+        latencies = sorted(latency for latency, _, _ in items)
+        conversion_errors = sum(1 for _, status, failed in items if failed and status < 300)
+        errors = conversion_errors + sum(1 for _, status, _ in items if status == 0 or status >= 500)
+        rejected = sum(1 for _, status, _ in items if status == 429)
+        client_errors = sum(1 for _, status, _ in items if 400 <= status < 500 and status != 429)
+        total += len(items)
+        total_errors += errors
+        endpoints[path] = {
+            'requests': len(items),
+            'throughput_rps': round(len(items) / wall, 2),
+            'error_rate': round(errors / len(items), 4),
+            'conversion_error_rate': round(conversion_errors / len(items), 4),
+            'rejected_429_rate': round(rejected / len(items), 4),
+            'client_error_rate': round(client_errors / len(items), 4),
+            'latency_ms': {
+                'p50': _percentile(latencies, 50),
+                'p95': _percentile(latencies, 95),
+                'p99': _percentile(latencies, 99),
+                'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2),
+            },
+        }
+
+    return {
+        'concurrency': concurrency,
+        'duration_s': round(wall, 2),
+        'requests': total,
+        'throughput_rps': round(total / wall, 2) if wall else 0.0,
+        'error_rate': round(total_errors / total, 4) if total else 0.0,
+        'endpoints': endpoints,
+    }
+
+
+def start_api(supabase_url: str, port: int, extra_env: Dict[str, str]) -> subprocess.Popen:
+    """Inicia o invoice_api em um subprocesso apontando para o PostgREST falso"""
+    env = dict(os.environ, SUPABASE_URL=supabase_url, SUPABASE_SERVICE_ROLE_KEY=FAKE_SERVICE_KEY, **extra_env)
+    code = (
+        'import invoice_api; '
+        f"invoice_api.app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"
+    )
+    return subprocess.Popen([sys.executable, '-c', code], cwd=SCRIPTS_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'invoice_api encerrou durante a inicialização (código {process.returncode})')
+        try:
+            with urllib.request.urlopen(base_url + '/ready', timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError('invoice_api não ficou pronto (/ready) a tempo')
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ('extract', 'match', 'reconcile', 'analyze-batch'):
+            raise argparse.ArgumentTypeError(f'endpoint desconhecido no mix: {name}')
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('o mix precisa de ao menos um peso positivo')
+    return mix
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Teste de carga offline do invoice_api')
+    parser.add_argument('--tenants', type=int, default=3, help='Empresas no banco falso')
+    parser.add_argument('--payables', type=int, default=1000, help='Payables por empresa')
+    parser.add_argument('--concurrency', default='1,4,16', help='Níveis de concorrência (ex.: 1,4,16)')
+    parser.add_argument('--duration', type=float, default=20.0, help='Segundos por nível')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Pesos por endpoint (padrão: {DEFAULT_MIX})')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Timeout por requisição (s)')
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--api-env', action='append', default=[], metavar='CHAVE=VALOR',
+                        help='Variável de ambiente extra para a API (repetível)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Arquivo do relatório JSON (padrão: stdout)')
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    extra_env = dict(item.split('=', 1) for item in args.api_env)
+    if not args.mix.get('analyze-batch'):
+        # Sem conversões na mistura, /ready não espera os modelos do Docling
+        extra_env.setdefault('WARM_UP_MODELS', '0')
+
+    db = FakeDatabase(tenants=args.tenants, payables_per_tenant=args.payables, seed=args.seed)
+    fake = start_server(db)
+    supabase_url = f'http://127.0.0.1:{fake.server_address[1]}'
+
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    api = start_api(supabase_url, port, extra_env)
+
+    try:
+        started = time.monotonic()
+        wait_ready(base_url, api, args.startup_timeout)
+        startup_s = time.monotonic() - started
+
+        traffic = TrafficGenerator(db, args.mix, seed=args.seed)
+        results = []
+        for concurrency in levels:
+            print(f'Nível de concorrência {concurrency}...', file=sys.stderr)
+            results.append(run_level(base_url, traffic, concurrency, args.duration, args.timeout))
+    finally:
+        api.terminate()
+        try:
+            api.wait(10)
+        except subprocess.TimeoutExpired:
+            api.kill()
+        fake.shutdown()
+
+    report = {
+        'config': {
+            'tenants': args.tenants,
+            'payables_per_tenant': args.payables,
+            'mix': args.mix,
+            'duration_per_level_s': args.duration,
+            'api_env': extra_env,
+        },
+        'api_startup_s': round(startup_s, 2),
+        'levels': results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
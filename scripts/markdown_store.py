@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Armazenamento versionado do markdown gerado pelo Docling
+Permite reaplicar as regras de extração sem reconverter os PDFs
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+from datetime import datetime
+from typing import Optional, Dict, Any, Iterator
+from dataclasses import dataclass
+
+
+# Versão do formato dos artefatos gravados (markdown + metadados)
+# 2: markdown com marcadores de quebra de página (invoice_extractor.PAGE_BREAK)
+ARTIFACT_VERSION = 2
+
+
+def _converter_version() -> Optional[str]:
+    """Versão instalada do Docling, registrada junto com o artefato"""
+    try:
+        from importlib.metadata import version
+        return version('docling')
+    except Exception:
+        return None
+
+
+def file_sha256(path: str) -> str:
+    """Hash SHA-256 do conteúdo de um arquivo (chave do artefato)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _atomic_write(path: str, content: str):
+    """Grava o arquivo via arquivo temporário + rename"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+@dataclass
+class StoredMarkdown:
+    """Artefato armazenado: markdown de um PDF e seus metadados"""
+    key: str
+    markdown_path: str
+    meta: Dict[str, Any]
+
+    def read_markdown(self) -> str:
+        with open(self.markdown_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+
+class MarkdownStore:
+    """
+    Guarda o markdown de cada PDF convertido, indexado pelo SHA-256 do PDF
+
+    Layout em disco:
+        <root>/<sha[:2]>/<sha>.md    markdown exportado pelo Docling
+        <root>/<sha[:2]>/<sha>.json  metadados (versões, campos extraídos)
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _paths(self, key: str) -> tuple:
+        directory = os.path.join(self.root_dir, key[:2])
+        return (
+            os.path.join(directory, f'{key}.md'),
+            os.path.join(directory, f'{key}.json'),
+        )
+
+    def save(self, pdf_path: str, markdown: str, extracted: Dict[str, Any],
+             rules_version: int, source_name: Optional[str] = None) -> str:
+        """
+        Grava o markdown e o snapshot dos campos extraídos
+
+        Returns:
+            Chave do artefato (SHA-256 do PDF)
+        """
+        key = file_sha256(pdf_path)
+        md_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(md_path), exist_ok=True)
+
+        meta = {
+            'artifact_version': ARTIFACT_VERSION,
+            'converter': 'docling',
+            'converter_version': _converter_version(),
+            'created_at': datetime.now().isoformat(),
+            'source_name': source_name,
+            'rules_version': rules_version,
+            'extracted': _snapshot_fields(extracted),
+        }
+
+        # Markdown primeiro: metadados só existem com o markdown completo
+        _atomic_write(md_path, markdown)
+        _atomic_write(meta_path, json.dumps(meta, ensure_ascii=False))
+        return key
+
+    def load(self, key: str) -> Optional[StoredMarkdown]:
+        """Carrega um artefato pela chave"""
+        md_path, meta_path = self._paths(key)
+        if not os.path.exists(meta_path) or not os.path.exists(md_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return StoredMarkdown(key=key, markdown_path=md_path, meta=meta)
+
+    def iter_entries(self) -> Iterator[StoredMarkdown]:
+        """Percorre os artefatos sob demanda, sem carregar o acervo em memória"""
+        with os.scandir(self.root_dir) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        if not entry.name.endswith('.json') or entry.name.startswith('.'):
+                            continue
+                        stored = self.load(entry.name[:-len('.json')])
+                        if stored is not None:
+                            yield stored
+
+    def update_extracted(self, key: str, extracted: Dict[str, Any], rules_version: int):
+        """Atualiza o snapshot dos campos extraídos após um reprocessamento"""
+        stored = self.load(key)
+        if stored is None:
+            return
+        meta = stored.meta
+        meta['extracted'] = _snapshot_fields(extracted)
+        meta['rules_version'] = rules_version
+        meta['reprocessed_at'] = datetime.now().isoformat()
+        _atomic_write(self._paths(key)[1], json.dumps(meta, ensure_ascii=False))
+
+
+def _snapshot_fields(extracted: Dict[str, Any]) -> Dict[str, Any]:
+    """Campos extraídos sem o raw_text (o markdown já está gravado)"""
+    return {k: v for k, v in extracted.items() if k != 'raw_text'}
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Cache de resultados de cruzamento (/match)
+Chave: impressão digital dos campos usados na pontuação + versão dos
+payables da empresa, incrementada a cada conciliação ou alteração de dados
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Hashable
+
+from invoice_extractor import ExtractedInvoiceData, PayableMatcher
+
+
+def extraction_fingerprint(extracted: ExtractedInvoiceData) -> str:
+    """Hash estável dos campos de ExtractedInvoiceData que influenciam o score"""
+    values = [getattr(extracted, field) for field in PayableMatcher.SCORING_FIELDS]
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PayablesVersions:
+    """
+    Versão do conjunto de payables de cada empresa, compartilhada entre processos
+
+    Cada empresa tem um arquivo <root>/<company_id>.version com um contador,
+    incrementado sob flock; todos os workers da máquina leem o mesmo valor,
+    então uma conciliação em um worker invalida o cache de todos.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, company_id: str) -> str:
+        safe = re.sub(r'[^A-Za-z0-9_\-]', '_', company_id)
+        return os.path.join(self.root_dir, f'{safe}.version')
+
+    def get(self, company_id: str) -> int:
+        try:
+            with open(self._path(company_id), 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self, company_id: str) -> int:
+        """Invalida os resultados em cache da empresa (em todos os processos)"""
+        with open(self._path(company_id), 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                version = int(f.read().strip() or 0) + 1
+            except ValueError:
+                version = 1
+            f.seek(0)
+            f.truncate()
+            f.write(str(version))
+            f.flush()
+            return version
+
+
+class MatchCache:
+    """
+    LRU limitado de resultados de PayableMatcher.find_matches
+
+    Args:
+        max_entries: número máximo de resultados guardados
+        ttl: validade (segundos) de cada entrada, para alterações feitas fora
+             da API que não incrementam a versão; 0 desativa
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(company_id: str, filters: Optional[Dict[str, Any]],
+                 extracted: ExtractedInvoiceData, version: Hashable) -> tuple:
+        filters_key = json.dumps(filters or {}, sort_keys=True, default=str)
+        return (company_id, version, filters_key, extraction_fingerprint(extracted))
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, result = entry
+                if not self.ttl or time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return result
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def put(self, key: tuple, result: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+            }
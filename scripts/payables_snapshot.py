@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Snapshot colunar de payables compartilhado entre processos
+Cada empresa tem um arquivo mapeado em memória (mmap) com colunas de largura
+fixa; todos os workers leem o mesmo arquivo sem copiar os dados. Atualizações
+publicam uma nova geração e trocam o ponteiro CURRENT de forma atômica.
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import math
+import struct
+import fcntl
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterator, Sequence, Callable
+
+
+MAGIC = b'PAYSNAP1'
+FORMAT_VERSION = 1
+
+_CNPJ_WIDTH = 14
+_DATE_WIDTH = 10
+_ALIGN = 8
+
+
+def _pad(buffer: bytearray):
+    buffer.extend(b'\0' * (-len(buffer) % _ALIGN))
+
+
+def _fixed(value: Optional[str], width: int) -> bytes:
+    raw = (value or '').encode('ascii', 'ignore')[:width]
+    return raw.ljust(width, b'\0')
+
+
+def build_snapshot(company_id: str, generation: int, payables: List[Dict[str, Any]]) -> bytes:
+    """
+    Serializa payables (formato de get_payables_for_matching) em blocos colunares
+
+    Colunas:
+        amount          float64 (NaN quando ausente)
+        due_date        10 bytes ASCII (YYYY-MM-DD)
+        supplier_cnpj   14 bytes ASCII, só dígitos
+        document_number offsets uint64 + texto UTF-8
+        records         offsets uint64 + JSON do payable completo (lido só nos matches)
+    """
+    n = len(payables)
+    columns = {}
+    body = bytearray()
+
+    def add_column(name: str, data: bytes):
+        _pad(body)
+        columns[name] = [len(body), len(data)]
+        body.extend(data)
+
+    amounts = [float(p['amount']) if p.get('amount') is not None else math.nan for p in payables]
+    add_column('amount', struct.pack(f'<{n}d', *amounts))
+    add_column('due_date', b''.join(
+        _fixed(str(p['due_date'])[:_DATE_WIDTH] if p.get('due_date') else None, _DATE_WIDTH)
+        for p in payables
+    ))
+    add_column('supplier_cnpj', b''.join(
+        _fixed(re.sub(r'[^\d]', '', p.get('supplier_cnpj') or ''), _CNPJ_WIDTH)
+        for p in payables
+    ))
+
+    for name, values in (
+        ('document_number', [str(p['document_number']) if p.get('document_number') else '' for p in payables]),
+        ('records', [json.dumps(p, ensure_ascii=False, default=str) for p in payables]),
+    ):
+        encoded = [v.encode('utf-8') for v in values]
+        offsets = [0]
+        for item in encoded:
+            offsets.append(offsets[-1] + len(item))
+        add_column(f'{name}_offsets', struct.pack(f'<{n + 1}Q', *offsets))
+        add_column(f'{name}_data', b''.join(encoded))
+
+    header = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'company_id': company_id,
+        'generation': generation,
+        'rows': n,
+        'created_at': datetime.now().isoformat(),
+        'published_at': time.time(),
+        'columns': columns,
+    }).encode('utf-8')
+
+    prefix = bytearray(MAGIC + struct.pack('<I', len(header)) + header)
+    _pad(prefix)
+    # Offsets das colunas são relativos ao início do corpo
+    return bytes(prefix) + bytes(body)
+
+
+class PayablesSnapshot:
+    """Leitura zero-copy de um snapshot mapeado em memória"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buffer = memoryview(self._mmap)
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'Snapshot inválido: {path}')
+        header_len = struct.unpack_from('<I', buffer, len(MAGIC))[0]
+        header_end = len(MAGIC) + 4 + header_len
+        self.header = json.loads(bytes(buffer[len(MAGIC) + 4:header_end]))
+        body_start = header_end + (-header_end % _ALIGN)
+
+        self.generation: int = self.header['generation']
+        self.rows: int = self.header['rows']
+        self.published_at: float = self.header.get('published_at') or os.path.getmtime(path)
+
+        def column(name: str) -> memoryview:
+            offset, length = self.header['columns'][name]
+            return buffer[body_start + offset:body_start + offset + length]
+
+        self._amount = column('amount').cast('d')
+        self._due_date = column('due_date')
+        self._cnpj = column('supplier_cnpj')
+        self._doc_offsets = column('document_number_offsets').cast('Q')
+        self._doc_data = column('document_number_data')
+        self._rec_offsets = column('records_offsets').cast('Q')
+        self._rec_data = column('records_data')
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def close(self):
+        """Desfaz o mapeamento e fecha o descritor (o snapshot não pode mais ser lido)"""
+        for name in ('_amount', '_due_date', '_cnpj', '_doc_offsets', '_doc_data',
+                     '_rec_offsets', '_rec_data'):
+            getattr(self, name).release()
+        self._mmap.close()
+
+    def age(self) -> float:
+        """Segundos desde a publicação desta geração"""
+        return time.time() - self.published_at
+
+    def amount(self, i: int) -> Optional[float]:
+        value = self._amount[i]
+        return None if math.isnan(value) else value
+
+    def due_date(self, i: int) -> Optional[str]:
+        raw = bytes(self._due_date[i * _DATE_WIDTH:(i + 1) * _DATE_WIDTH]).rstrip(b'\0')
+        return raw.decode('ascii') if raw else None
+
+    def supplier_cnpj(self, i: int) -> Optional[str]:
+        raw = bytes(self._cnpj[i * _CNPJ_WIDTH:(i + 1) * _CNPJ_WIDTH]).rstrip(b'\0')
+        return raw.decode('ascii') if raw else None
+
+    def document_number(self, i: int) -> Optional[str]:
+        start, end = self._doc_offsets[i], self._doc_offsets[i + 1]
+        return str(self._doc_data[start:end], 'utf-8') if end > start else None
+
+    def payable(self, i: int) -> Dict[str, Any]:
+        """Payable completo (decodificado apenas quando necessário)"""
+        start, end = self._rec_offsets[i], self._rec_offsets[i + 1]
+        return json.loads(str(self._rec_data[start:end], 'utf-8'))
+
+    def select(self, filters: Optional[Dict[str, Any]] = None) -> 'PayablesView':
+        """Aplica os mesmos filtros de get_payables_for_matching sobre as colunas"""
+        filters = filters or {}
+        min_date, max_date = filters.get('min_date'), filters.get('max_date')
+        min_amount, max_amount = filters.get('min_amount'), filters.get('max_amount')
+
+        if not (min_date or max_date or min_amount or max_amount):
+            return PayablesView(self, range(self.rows))
+
+        indices = []
+        for i in range(self.rows):
+            if min_date or max_date:
+                due = self.due_date(i)
+                if due is None or (min_date and due < min_date) or (max_date and due > max_date):
+                    continue
+            if min_amount or max_amount:
+                amount = self.amount(i)
+                if amount is None or (min_amount and amount < float(min_amount)) \
+                        or (max_amount and amount > float(max_amount)):
+                    continue
+            indices.append(i)
+        return PayablesView(self, indices)
+
+
+class PayablesView:
+    """Subconjunto de linhas de um snapshot, aceito diretamente pelo PayableMatcher"""
+
+    def __init__(self, snapshot: PayablesSnapshot, indices: Sequence[int]):
+        self.snapshot = snapshot
+        self.indices = indices
+        self.generation = snapshot.generation
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def scoring_rows(self) -> Iterator[tuple]:
+        """(índice, cnpj, valor, vencimento, nº documento) de cada linha"""
+        s = self.snapshot
+        amounts = s._amount
+        cnpjs = s._cnpj
+        dates = s._due_date
+        doc_offsets = s._doc_offsets
+        doc_data = s._doc_data
+        isnan = math.isnan
+
+        # Só as linhas selecionadas são lidas do mapeamento (sem copiar as colunas)
+        for i in self.indices:
+            amount = amounts[i]
+            cnpj = str(cnpjs[i * _CNPJ_WIDTH:(i + 1) * _CNPJ_WIDTH], 'ascii').rstrip('\0')
+            due_date = str(dates[i * _DATE_WIDTH:(i + 1) * _DATE_WIDTH], 'ascii').rstrip('\0')
+            start, end = doc_offsets[i], doc_offsets[i + 1]
+            yield (
+                i,
+                cnpj or None,
+                None if isnan(amount) else amount,
+                due_date or None,
+                str(doc_data[start:end], 'utf-8') if end > start else None,
+            )
+
+    def payable(self, i: int) -> Dict[str, Any]:
+        return self.snapshot.payable(i)
+
+
+class PayablesSnapshotStore:
+    """
+    Diretório de snapshots por empresa, compartilhado entre processos
+
+    Layout:
+        <root>/<company_id>/gen-<n>.snap     snapshot da geração n
+        <root>/<company_id>/CURRENT          número da geração publicada
+        <root>/<company_id>/INVALIDATIONS    contador de invalidações
+        <root>/<company_id>/.lock            serializa publicações e invalidações (flock)
+        <root>/<company_id>/.refresh.lock    uma única busca no banco por vez (flock)
+
+    Args:
+        root_dir: diretório dos snapshots
+        max_age: idade máxima (segundos) de uma geração; depois disso ela é
+                 republicada, para captar alterações feitas fora da API
+                 (ex.: direto no Supabase pelo frontend). 0 desativa
+        max_open: snapshots mantidos mapeados por processo (LRU); cada um
+                  ocupa um descritor de arquivo e um mapeamento
+    """
+
+    def __init__(self, root_dir: str, max_age: float = 300.0, max_open: int = 64):
+        self.root_dir = root_dir
+        self.max_age = max_age
+        self.max_open = max_open
+        os.makedirs(root_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._open: 'OrderedDict[str, PayablesSnapshot]' = OrderedDict()
+
+    def _company_dir(self, company_id: str) -> str:
+        safe = re.sub(r'[^A-Za-z0-9_\-]', '_', company_id)
+        return os.path.join(self.root_dir, safe)
+
+    def current_generation(self, company_id: str) -> Optional[int]:
+        try:
+            with open(os.path.join(self._company_dir(company_id), 'CURRENT'), 'r') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def invalidation_token(self, company_id: str) -> int:
+        """Contador de invalidações; lido antes de buscar os payables no banco"""
+        try:
+            with open(os.path.join(self._company_dir(company_id), 'INVALIDATIONS'), 'r') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def publish(self, company_id: str, payables: List[Dict[str, Any]],
+                token: Optional[int] = None) -> Optional[int]:
+        """
+        Grava uma nova geração e a torna visível para todos os processos
+
+        Args:
+            token: invalidation_token() lido antes da busca dos payables. Se
+                   houve uma invalidação depois dele, os dados podem ser
+                   anteriores a ela e nada é publicado (retorna None)
+        """
+        directory = self._company_dir(company_id)
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if token is not None and self.invalidation_token(company_id) != token:
+                return None
+            generation = self._latest_generation(directory) + 1
+            data = build_snapshot(company_id, generation, payables)
+
+            self._write_atomic(directory, f'gen-{generation}.snap', data)
+            self._write_atomic(directory, 'CURRENT', str(generation).encode('ascii'))
+
+            # Gerações antigas: leitores que ainda as mapeiam continuam válidos
+            for name in os.listdir(directory):
+                match = re.match(r'gen-(\d+)\.snap$', name)
+                if match and int(match.group(1)) < generation - 1:
+                    os.unlink(os.path.join(directory, name))
+
+        return generation
+
+    def invalidate(self, company_id: str):
+        """
+        Retira a geração publicada; a próxima leitura publica uma nova
+
+        Publicações com dados buscados antes desta chamada são descartadas.
+        """
+        directory = self._company_dir(company_id)
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            token = self.invalidation_token(company_id) + 1
+            self._write_atomic(directory, 'INVALIDATIONS', str(token).encode('ascii'))
+            try:
+                os.unlink(os.path.join(directory, 'CURRENT'))
+            except FileNotFoundError:
+                pass
+
+    def open(self, company_id: str) -> Optional[PayablesSnapshot]:
+        """Snapshot da geração publicada (mapeado uma vez por processo); None se ausente ou vencido"""
+        generation = self.current_generation(company_id)
+        if generation is None:
+            return None
+
+        with self._lock:
+            snapshot = self._open.get(company_id)
+            if snapshot is None or snapshot.generation != generation:
+                path = os.path.join(self._company_dir(company_id), f'gen-{generation}.snap')
+                try:
+                    new_snapshot = PayablesSnapshot(path)
+                except FileNotFoundError:
+                    return None
+                if snapshot is not None:
+                    snapshot = None
+                    self._retire(self._open.pop(company_id))
+                snapshot = self._open[company_id] = new_snapshot
+                while len(self._open) > self.max_open:
+                    self._retire(self._open.popitem(last=False)[1])
+            else:
+                self._open.move_to_end(company_id)
+
+        if self.max_age and snapshot.age() > self.max_age:
+            return None
+        return snapshot
+
+    def refresh(self, company_id: str,
+                fetch: Callable[[], List[Dict[str, Any]]]) -> Optional[PayablesSnapshot]:
+        """
+        Publica uma geração nova com os payables de fetch() e a retorna
+
+        Só um processo por vez busca os dados de uma empresa; os demais esperam
+        e reaproveitam a geração publicada por ele. Uma empresa sem payables
+        também ganha uma geração (vazia), para não buscar de novo a cada leitura.
+        Retorna None quando uma invalidação ocorreu durante a busca. Erros de
+        fetch() são propagados sem publicar nada.
+        """
+        directory = self._company_dir(company_id)
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, '.refresh.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Outro processo pode ter publicado enquanto esperávamos o lock
+            snapshot = self.open(company_id)
+            if snapshot is not None:
+                return snapshot
+
+            token = self.invalidation_token(company_id)
+            payables = fetch()
+            if self.publish(company_id, payables, token=token) is None:
+                return None
+        return self.open(company_id)
+
+    @staticmethod
+    def _retire(snapshot: PayablesSnapshot):
+        """
+        Fecha um snapshot que saiu do cache (chamado com self._lock)
+
+        Fora do cache, ninguém obtém novas referências a ele. Se só restam o
+        parâmetro e o argumento de getrefcount, fecha já; senão uma
+        requisição ainda o lê, e o CPython desfaz o mapeamento e fecha o
+        descritor quando a última PayablesView for liberada.
+        """
+        if sys.getrefcount(snapshot) <= 2:
+            snapshot.close()
+
+    def close(self):
+        """Fecha todos os snapshots mapeados pelo processo"""
+        with self._lock:
+            while self._open:
+                self._retire(self._open.popitem(last=False)[1])
+
+    @staticmethod
+    def _latest_generation(directory: str) -> int:
+        generations = [
+            int(m.group(1)) for m in
+            (re.match(r'gen-(\d+)\.snap$', name) for name in os.listdir(directory)) if m
+        ]
+        return max(generations, default=0)
+
+    @staticmethod
+    def _write_atomic(directory: str, name: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(directory, name))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Perfilamento sob demanda de requisições
+Amostra a pilha da thread da requisição em intervalos fixos e grava, por
+captura, um flamegraph (SVG e formato folded) e um arquivo pstats
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import marshal
+import threading
+from collections import Counter
+from datetime import datetime
+from html import escape
+from typing import Dict, List, Any, Optional
+
+
+class SamplingProfiler:
+    """
+    Amostrador de pilha de uma única thread
+
+    samples conta as amostras por pilha; seconds soma, por pilha, o tempo real
+    decorrido desde a amostra anterior. O intervalo é só nominal: a thread do
+    amostrador precisa do GIL para acordar e, com código CPU-bound, amostra bem
+    menos vezes do que 1/interval por segundo.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.seconds: Counter = Counter()
+        self._stop = threading.Event()
+        self._paused = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def pause(self):
+        """Suspende a amostragem (ex.: enquanto outro processo trabalha pela thread)"""
+        self._paused.set()
+
+    def resume(self):
+        self._paused.clear()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            if self._paused.is_set():
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                # Da raiz para a folha
+                stack = tuple(reversed(stack))
+                self.samples[stack] += 1
+                self.seconds[stack] += elapsed
+
+
+def current_stack(skip: int = 1) -> tuple:
+    """Pilha da thread atual, da raiz até o chamador (mesmo formato das amostras)"""
+    frame = sys._getframe(skip)
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def _label(func: tuple) -> str:
+    filename, lineno, name = func
+    return f'{name} ({os.path.basename(filename)}:{lineno})'
+
+
+def write_folded(samples: Counter, path: str):
+    """Pilhas no formato folded (flamegraph.pl, speedscope, inferno)"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in samples.most_common():
+            f.write(';'.join(_label(func) for func in stack) + f' {count}\n')
+
+
+def write_pstats(samples: Counter, seconds: Counter, path: str):
+    """
+    Converte as amostras no formato lido por pstats.Stats
+
+    tt (tempo próprio) soma o tempo real das amostras em que a função está no
+    topo da pilha; ct (tempo acumulado) o das amostras em que ela aparece em
+    qualquer posição. As contagens de chamadas são as contagens de amostras.
+    """
+    stats: Dict[tuple, list] = {}
+    callers: Dict[tuple, Dict[tuple, list]] = {}
+
+    for stack, count in samples.items():
+        elapsed = seconds.get(stack, 0.0)
+        for func in set(stack):
+            entry = stats.setdefault(func, [0, 0, 0.0, 0.0])
+            entry[0] += count
+            entry[1] += count
+            entry[3] += elapsed
+        stats[stack[-1]][2] += elapsed
+        for caller, callee in set(zip(stack, stack[1:])):
+            entry = callers.setdefault(callee, {}).setdefault(caller, [0, 0.0])
+            entry[0] += count
+            entry[1] += elapsed
+
+    data = {}
+    for func, (cc, nc, tt, ct) in stats.items():
+        func_callers = {
+            caller: (n, n, 0.0, elapsed)
+            for caller, (n, elapsed) in callers.get(func, {}).items()
+        }
+        data[func] = (cc, nc, tt, ct, func_callers)
+
+    with open(path, 'wb') as f:
+        marshal.dump(data, f)
+
+
+def write_flamegraph_svg(samples: Counter, path: str, title: str = '', width: int = 1200):
+    """Flamegraph SVG autônomo (raiz embaixo, largura proporcional às amostras)"""
+    root = {'name': 'all', 'value': 0, 'children': {}}
+    for stack, count in samples.items():
+        root['value'] += count
+        node = root
+        for func in stack:
+            node = node['children'].setdefault(_label(func), {'name': _label(func), 'value': 0, 'children': {}})
+            node['value'] += count
+
+    def depth(node) -> int:
+        return 1 + max((depth(child) for child in node['children'].values()), default=0)
+
+    frame_height = 16
+    levels = depth(root)
+    height = (levels + 2) * frame_height
+    total = root['value'] or 1
+    rects = []
+
+    def draw(node, x: float, level: int):
+        w = node['value'] / total * width
+        if w < 0.5:
+            return
+        y = height - (level + 1) * frame_height
+        hue = 10 + (hash(node['name']) % 50)
+        pct = node['value'] / total * 100
+        # Texto cortado para caber no retângulo (~7px por caractere)
+        text = escape(node['name'][:int(w / 7) - 1]) if w > 30 else ''
+        rects.append(
+            f'<g><title>{escape(node["name"])} ({node["value"]} amostras, {pct:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{frame_height - 1}" '
+            f'fill="hsl({hue},85%,60%)"/>'
+            f'<text x="{x + 3:.1f}" y="{y + 11}" font-size="11" font-family="monospace">{text}</text></g>'
+        )
+        child_x = x
+        for child in sorted(node['children'].values(), key=lambda c: c['name']):
+            draw(child, child_x, level + 1)
+            child_x += child['value'] / total * width
+
+    draw(root, 0.0, 0)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}">'
+            f'<text x="4" y="12" font-size="12" font-family="monospace">{escape(title)}</text>'
+            + ''.join(rects) + '</svg>'
+        )
+
+
+class _Capture:
+    def __init__(self, capture_id: str, label: str, profiler: SamplingProfiler):
+        self.id = capture_id
+        self.label = label
+        self.profiler = profiler
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+
+    @property
+    def interval(self) -> float:
+        return self.profiler.interval
+
+    def merge(self, samples: Dict[tuple, int], seconds: Dict[tuple, float], prefix: tuple = ()):
+        """Acrescenta amostras (e seus tempos) de outro processo, penduradas sob `prefix`"""
+        for stack, count in samples.items():
+            key = prefix + tuple(stack)
+            self.profiler.samples[key] += count
+            self.profiler.seconds[key] += seconds.get(stack, 0.0)
+
+
+# Captura ativa na thread da requisição; permite que o pool de conversão
+# perfile o worker e devolva as amostras para a mesma captura
+_active = threading.local()
+
+
+def active_capture() -> Optional[_Capture]:
+    return getattr(_active, 'capture', None)
+
+
+class RequestProfiler:
+    """
+    Decide quais requisições perfilar e guarda as capturas em disco
+
+    Args:
+        directory: diretório das capturas (limitado a max_captures)
+        sample_rate: fração de requisições perfiladas automaticamente (0 desativa)
+        admin_token: token exigido no perfilamento por cabeçalho e na listagem
+        max_captures: capturas mantidas; as mais antigas são apagadas
+        interval: intervalo de amostragem (segundos)
+    """
+
+    KINDS = ('svg', 'folded', 'pstats')
+
+    def __init__(self, directory: str, sample_rate: float = 0.0, admin_token: str = '',
+                 max_captures: int = 50, interval: float = 0.005):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self.max_captures = max_captures
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def is_admin(self, headers) -> bool:
+        token = headers.get('X-Admin-Token')
+        return bool(self.admin_token and token and hmac.compare_digest(token, self.admin_token))
+
+    def should_profile(self, headers) -> bool:
+        """Cabeçalho X-Profile com token de admin, ou amostragem aleatória"""
+        if headers.get('X-Profile') and self.is_admin(headers):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, label: str) -> _Capture:
+        profiler = SamplingProfiler(threading.get_ident(), self.interval)
+        profiler.start()
+        # Prefixo com microssegundos: a ordem lexicográfica é a ordem de início
+        capture_id = datetime.now().strftime('%Y%m%d-%H%M%S%f-') + uuid.uuid4().hex[:6]
+        capture = _Capture(capture_id, label, profiler)
+        _active.capture = capture
+        return capture
+
+    def finish(self, capture: _Capture, status: Optional[int] = None) -> Dict[str, Any]:
+        """Encerra a amostragem e grava flamegraph, folded, pstats e metadados"""
+        if active_capture() is capture:
+            _active.capture = None
+        capture.profiler.stop()
+        duration = time.perf_counter() - capture.started
+        samples = capture.profiler.samples
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, capture.id)
+        title = f'{capture.label} — {duration * 1000:.0f} ms, {sum(samples.values())} amostras'
+        write_flamegraph_svg(samples, base + '.svg', title=title)
+        write_folded(samples, base + '.folded')
+        write_pstats(samples, capture.profiler.seconds, base + '.pstats')
+
+        meta = {
+            'id': capture.id,
+            'label': capture.label,
+            'status': status,
+            'started_at': capture.started_at.isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'samples': sum(samples.values()),
+            'sampled_ms': round(sum(capture.profiler.seconds.values()) * 1000, 2),
+            'interval_ms': self.interval * 1000,
+        }
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        self._prune()
+        return meta
+
+    def _prune(self):
+        with self._lock:
+            captures = sorted(name[:-len('.json')] for name in os.listdir(self.directory)
+                              if name.endswith('.json'))
+            for capture_id in captures[:max(len(captures) - self.max_captures, 0)]:
+                for ext in ('json',) + self.KINDS:
+                    try:
+                        os.unlink(os.path.join(self.directory, f'{capture_id}.{ext}'))
+                    except FileNotFoundError:
+                        pass
+
+    def list_captures(self) -> List[Dict[str, Any]]:
+        """Capturas mais recentes primeiro"""
+        if not os.path.isdir(self.directory):
+            return []
+        captures = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    captures.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return captures
+
+    def capture_path(self, capture_id: str, kind: str) -> Optional[str]:
+        if kind not in self.KINDS or not all(c.isalnum() or c == '-' for c in capture_id):
+            return None
+        path = os.path.join(self.directory, f'{capture_id}.{kind}')
+        return path if os.path.exists(path) else None
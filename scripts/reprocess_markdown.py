@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Reprocessamento em lote do markdown armazenado
+Reaplica as regras de extração (_extract_from_text) sobre o acervo gravado
+pelo MarkdownStore, sem reconverter os PDFs, e gera um relatório de mudanças
+
+Uso:
+    python reprocess_markdown.py --store /dados/markdown --report mudancas.jsonl
+    python reprocess_markdown.py --store /dados/markdown --workers 8 --write
+    python reprocess_markdown.py --store /dados/markdown --all --report mudancas.jsonl
+
+Artefatos já extraídos com a EXTRACTION_RULES_VERSION atual são pulados (--all
+reprocessa tudo). Com --write, todo artefato reprocessado recebe a versão atual,
+mesmo sem campos alterados.
+"""
+
+import os
+import sys
+import json
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import asdict
+from itertools import islice
+from typing import Dict, List, Any, Iterable, Iterator, Optional
+
+from markdown_store import MarkdownStore, StoredMarkdown
+from invoice_extractor import InvoiceExtractor, EXTRACTION_RULES_VERSION
+
+
+# Extrator por processo worker (sem conversor Docling: só regex)
+_worker_extractor: Optional[InvoiceExtractor] = None
+
+
+def _init_worker():
+    global _worker_extractor
+    _worker_extractor = InvoiceExtractor()
+
+
+def diff_fields(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Compara dois snapshots de campos extraídos (raw_text é ignorado)"""
+    changes = {}
+    for field in sorted(set(old) | set(new)):
+        if field == 'raw_text':
+            continue
+        if old.get(field) != new.get(field):
+            changes[field] = {'old': old.get(field), 'new': new.get(field)}
+    return changes
+
+
+def _reextract_chunk(chunk: List[tuple]) -> List[Dict[str, Any]]:
+    """Reextrai um bloco de artefatos dentro de um processo worker"""
+    results = []
+    for key, markdown_path, old_fields in chunk:
+        try:
+            with open(markdown_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            new_fields = asdict(_worker_extractor.extract_from_text(text))
+            new_fields.pop('raw_text', None)
+            results.append({
+                'key': key,
+                'changes': diff_fields(old_fields, new_fields),
+                'extracted': new_fields,
+            })
+        except Exception as e:
+            results.append({'key': key, 'error': str(e)})
+    return results
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def is_outdated(stored: StoredMarkdown) -> bool:
+    """Artefato extraído com regras anteriores à EXTRACTION_RULES_VERSION atual"""
+    return stored.meta.get('rules_version') != EXTRACTION_RULES_VERSION
+
+
+def reprocess(store: MarkdownStore, workers: Optional[int] = None,
+              chunksize: int = 64, max_pending: Optional[int] = None,
+              include_current: bool = False,
+              stats: Optional[Counter] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Reextrai o acervo em paralelo, lendo a entrada sob demanda
+
+    Por padrão só os artefatos desatualizados (is_outdated) são reextraídos;
+    include_current=True reprocessa todos. Os pulados são contados em
+    stats['skipped'], quando informado.
+
+    Apenas `max_pending` blocos ficam em voo por vez, então o consumo de memória
+    independe do tamanho do acervo. Os resultados saem na ordem de conclusão.
+
+    Yields:
+        Dict com key, changes e extracted (ou key e error)
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+
+    def entries():
+        for stored in store.iter_entries():
+            if not include_current and not is_outdated(stored):
+                if stats is not None:
+                    stats['skipped'] += 1
+                continue
+            yield stored.key, stored.markdown_path, stored.meta.get('extracted') or {}
+
+    chunks = _chunks(entries(), chunksize)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(_reextract_chunk, chunk))
+            if len(pending) < max_pending:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+        for future in pending:
+            yield from future.result()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Reprocessa o markdown armazenado com as regras atuais')
+    parser.add_argument('--store', default=os.environ.get('MARKDOWN_STORE_DIR'),
+                        help='Diretório do MarkdownStore (padrão: $MARKDOWN_STORE_DIR)')
+    parser.add_argument('--report', help='Arquivo JSONL com uma linha por documento alterado')
+    parser.add_argument('--workers', type=int, default=None, help='Processos paralelos (padrão: nº de CPUs)')
+    parser.add_argument('--chunksize', type=int, default=64, help='Documentos por bloco enviado a um worker')
+    parser.add_argument('--write', action='store_true',
+                        help='Atualiza o snapshot armazenado e a versão das regras de cada documento reprocessado')
+    parser.add_argument('--all', action='store_true',
+                        help='Reprocessa também os documentos já extraídos com a versão atual das regras')
+    args = parser.parse_args(argv)
+
+    if not args.store:
+        parser.error('informe --store ou defina MARKDOWN_STORE_DIR')
+
+    store = MarkdownStore(args.store)
+    report = open(args.report, 'w', encoding='utf-8') if args.report else None
+
+    total = 0
+    changed = 0
+    errors = 0
+    changed_fields = Counter()
+    stats = Counter()
+
+    try:
+        for result in reprocess(store, workers=args.workers, chunksize=args.chunksize,
+                                include_current=args.all, stats=stats):
+            total += 1
+
+            if 'error' in result:
+                errors += 1
+                print(f"Erro ao reprocessar {result['key']}: {result['error']}", file=sys.stderr)
+                continue
+
+            # Grava mesmo sem mudanças: o artefato passa a constar como atualizado
+            if args.write:
+                store.update_extracted(result['key'], result['extracted'], EXTRACTION_RULES_VERSION)
+
+            if not result['changes']:
+                continue
+
+            changed += 1
+            changed_fields.update(result['changes'].keys())
+
+            if report:
+                report.write(json.dumps(
+                    {'key': result['key'], 'changes': result['changes']},
+                    ensure_ascii=False
+                ) + '\n')
+    finally:
+        if report:
+            report.close()
+
+    summary = {
+        'rules_version': EXTRACTION_RULES_VERSION,
+        'total_documents': total,
+        'skipped_current': stats['skipped'],
+        'changed_documents': changed,
+        'unchanged_documents': total - changed - errors,
+        'errors': errors,
+        'changed_fields': dict(changed_fields.most_common()),
+        'written': args.write,
+    }
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Testes da segmentação de carnês e extratos (InvoiceExtractor.extract_segments)
+Executar com: python -m pytest scripts/test_segmentation.py
+"""
+
+import pytest
+
+from invoice_extractor import (
+    InvoiceExtractor, ExtractedInvoiceData, PayableMatcher, PAGE_BREAK
+)
+
+
+LINHAS = [
+    '23793.38128 60000.000003 00000.000401 1 84340000150000',
+    '34191.09008 00001.234567 89012.345678 2 97000000020000',
+    '00190.00009 01234.567004 00000.001180 3 98500000030000',
+]
+
+
+def boleto_campos_primeiro(n: int, valor: str, vencimento: str, cnpj: str, linha: str) -> str:
+    """Layout do exemplo de invoice_extractor.py e do loadtest: campos e, por fim, o código"""
+    return (
+        'BOLETO BANCÁRIO\n\n'
+        f'Beneficiário: Fornecedor {n} Ltda\n'
+        f'CNPJ: {cnpj}\n\n'
+        'Pagador: Minha Empresa\n'
+        'CNPJ: 11.222.333/0001-44\n\n'
+        f'Valor: R$ {valor}\n'
+        f'Vencimento: {vencimento}\n\n'
+        f'Nosso Número: {n}000\n'
+        f'Código de Barras: {linha}\n'
+    )
+
+
+def ficha_codigo_no_topo(valor: str, vencimento: str, linha: str, recibo: bool = False) -> str:
+    """Ficha de compensação: banco e linha digitável no topo, campos abaixo"""
+    texto = ''
+    if recibo:
+        texto += f'Recibo do Pagador\n{linha}\n'
+    return texto + (
+        f'| Banco Itaú | 341-7 | {linha} |\n'
+        f'Vencimento {vencimento}\n'
+        f'Valor do Documento R$ {valor}\n'
+        'Beneficiário: Loja Exemplo CNPJ 12.345.678/0001-90\n'
+    )
+
+
+@pytest.fixture
+def extractor():
+    return InvoiceExtractor()
+
+
+def campos(segmentos):
+    return [(s.pagina, s.segmento, s.valor_total, s.data_vencimento, s.beneficiario_cnpj) for s in segmentos]
+
+
+def test_um_boleto_por_pagina_campos_primeiro(extractor):
+    texto = PAGE_BREAK.join([
+        boleto_campos_primeiro(1, '150,00', '10/01/2025', '12.345.678/0001-90', LINHAS[0]),
+        boleto_campos_primeiro(2, '200,00', '10/02/2025', '98.765.432/0001-10', LINHAS[1]),
+        boleto_campos_primeiro(3, '300,00', '10/03/2025', '45.678.901/0001-23', LINHAS[2]),
+    ])
+
+    esperado = [
+        (1, 1, 150.0, '2025-01-10', '12345678000190'),
+        (2, 2, 200.0, '2025-02-10', '98765432000110'),
+        (3, 3, 300.0, '2025-03-10', '45678901000123'),
+    ]
+    assert campos(extractor.extract_segments(texto)) == esperado
+    assert campos(extractor.extract_segments(texto, mode='boleto')) == esperado
+    assert campos(extractor.extract_segments(texto, mode='page')) == esperado
+
+
+def test_varios_boletos_na_pagina_campos_primeiro(extractor):
+    texto = ''.join([
+        boleto_campos_primeiro(1, '150,00', '10/01/2025', '12.345.678/0001-90', LINHAS[0]),
+        boleto_campos_primeiro(2, '200,00', '10/02/2025', '98.765.432/0001-10', LINHAS[1]),
+        boleto_campos_primeiro(3, '300,00', '10/03/2025', '45.678.901/0001-23', LINHAS[2]),
+    ])
+
+    segmentos = list(extractor.extract_segments(texto))
+    assert campos(segmentos) == [
+        (1, 1, 150.0, '2025-01-10', '12345678000190'),
+        (1, 2, 200.0, '2025-02-10', '98765432000110'),
+        (1, 3, 300.0, '2025-03-10', '45678901000123'),
+    ]
+    assert [s.linha_digitavel for s in segmentos] == LINHAS
+
+
+def test_varios_boletos_na_pagina_codigo_no_topo(extractor):
+    texto = (
+        'Carnê Loja Exemplo\n'
+        + ficha_codigo_no_topo('150,00', '10/01/2025', LINHAS[0], recibo=True)
+        + ficha_codigo_no_topo('200,00', '10/02/2025', LINHAS[1], recibo=True)
+    )
+
+    segmentos = list(extractor.extract_segments(texto))
+    assert [(s.valor_total, s.data_vencimento, s.linha_digitavel) for s in segmentos] == [
+        (150.0, '2025-01-10', LINHAS[0]),
+        (200.0, '2025-02-10', LINHAS[1]),
+    ]
+
+
+def test_mesma_linha_em_paginas_seguidas_e_um_boleto(extractor):
+    texto = PAGE_BREAK.join([
+        f'Recibo do Pagador\n{LINHAS[0]}\n',
+        ficha_codigo_no_topo('150,00', '10/01/2025', LINHAS[0]),
+        ficha_codigo_no_topo('200,00', '10/02/2025', LINHAS[1]),
+    ])
+
+    segmentos = list(extractor.extract_segments(texto, mode='boleto'))
+    assert [(s.pagina, s.valor_total) for s in segmentos] == [(1, 150.0), (3, 200.0)]
+
+
+def test_pagina_sem_linha_acompanha_o_proximo_boleto(extractor):
+    texto = PAGE_BREAK.join([
+        'Fatura 1 - detalhamento dos serviços\nTotal: R$ 150,00\n',
+        boleto_campos_primeiro(1, '150,00', '10/01/2025', '12.345.678/0001-90', LINHAS[0]),
+        'Fatura 2 - detalhamento dos serviços\nTotal: R$ 200,00\n',
+        boleto_campos_primeiro(2, '200,00', '10/02/2025', '98.765.432/0001-10', LINHAS[1]),
+    ])
+
+    segmentos = list(extractor.extract_segments(texto))
+    assert [(s.pagina, s.segmento, s.valor_total) for s in segmentos] == [(1, 1, 150.0), (3, 2, 200.0)]
+    assert 'Fatura 2' in segmentos[1].raw_text
+
+
+def test_documento_com_um_boleto_nao_e_dividido(extractor):
+    texto = PAGE_BREAK.join([
+        'Fatura mensal\nDetalhamento dos serviços\n',
+        boleto_campos_primeiro(1, '150,00', '10/01/2025', '12.345.678/0001-90', LINHAS[0]),
+    ])
+
+    segmentos = list(extractor.extract_segments(texto))
+    assert len(segmentos) == 1
+    assert (segmentos[0].pagina, segmentos[0].valor_total) == (1, 150.0)
+    assert len(list(extractor.extract_segments(texto, mode='page'))) == 2
+
+
+def test_cnpj_nao_vem_da_linha_digitavel(extractor):
+    texto = f'Boleto\n{LINHAS[0]}\nValor R$ 10,00\n'
+    assert extractor.extract_from_text(texto).beneficiario_cnpj is None
+
+
+def test_modo_invalido(extractor):
+    with pytest.raises(ValueError):
+        list(extractor.extract_segments('texto', mode='linha'))
+
+
+# Payables e resultados esperados obtidos do PayableMatcher original (antes do
+# find_matches_many): pontuação, detalhes, divergências e ação sugerida
+PAYABLES = [
+    {'id': '1', 'supplier_cnpj': '12.345.678/0001-90', 'amount': 150.0,
+     'due_date': '2025-01-10', 'document_number': 'NF 1000'},
+    {'id': '2', 'supplier_cnpj': '98.765.432/0001-10', 'amount': 200.0,
+     'due_date': '2025-02-10', 'document_number': '2000'},
+    {'id': '3', 'supplier_cnpj': '12.345.678/0001-90', 'amount': 150.5,
+     'due_date': '2025-03-10', 'document_number': None},
+    {'id': '4', 'supplier_cnpj': '12.345.678/0001-90', 'amount': 155.0,
+     'due_date': '2025-01-10T00:00:00', 'document_number': '1000'},
+    {'id': '5', 'supplier_cnpj': None, 'amount': 150.0,
+     'due_date': '2025-01-10', 'document_number': '1000'},
+]
+
+REGISTROS = [
+    ExtractedInvoiceData(document_type='boleto', raw_text='', valor_total=150.0, data_vencimento='2025-01-10',
+                         beneficiario_cnpj='12345678000190', numero_documento='1000'),
+    ExtractedInvoiceData(document_type='boleto', raw_text='', valor_total=200.0, numero_documento='2000'),
+    ExtractedInvoiceData(document_type='boleto', raw_text='', valor_total=999.0),
+    ExtractedInvoiceData(document_type='boleto', raw_text='', valor_total=195.0, data_vencimento='2025-02-11',
+                         beneficiario_cnpj='98765432000110'),
+]
+
+ESPERADO = [
+    ('SELECIONAR_MATCH', [
+        ('1', 100, ['CNPJ do fornecedor confere', 'Valor exato', 'Data de vencimento confere',
+                    'Número do documento confere'], []),
+        ('4', 80, ['CNPJ do fornecedor confere', 'Valor com pequena divergência (5.00)',
+                   'Data de vencimento confere', 'Número do documento confere'],
+         [{'field': 'valor', 'expected': 155.0, 'found': 150.0, 'difference': 5.0}]),
+    ], [
+        ('3', 60, ['CNPJ do fornecedor confere', 'Valor aproximado (diff: R$ 0.50)'],
+         [{'field': 'vencimento', 'expected': '2025-03-10', 'found': '2025-01-10'}]),
+        ('5', 60, ['Valor exato', 'Data de vencimento confere', 'Número do documento confere'], []),
+    ]),
+    ('REVISAR_MANUAL', [], [
+        ('2', 40, ['Valor exato', 'Número do documento confere'], []),
+    ]),
+    ('CRIAR_NOVO_LANCAMENTO', [], []),
+    ('REVISAR_MANUAL', [], [
+        ('2', 50, ['CNPJ do fornecedor confere', 'Valor com pequena divergência (5.00)'],
+         [{'field': 'valor', 'expected': 200.0, 'found': 195.0, 'difference': 5.0},
+          {'field': 'vencimento', 'expected': '2025-02-10', 'found': '2025-02-11'}]),
+    ]),
+]
+
+
+def resumo(resultado):
+    def matches(chave):
+        return [(m['payable']['id'], m['score'], m['details'], m['divergences']) for m in resultado[chave]]
+    return resultado['suggested_action'], matches('exact_matches'), matches('partial_matches')
+
+
+@pytest.fixture(params=['lista', 'snapshot'])
+def payables(request, tmp_path):
+    if request.param == 'lista':
+        return PAYABLES
+    from payables_snapshot import PayablesSnapshotStore
+    store = PayablesSnapshotStore(str(tmp_path))
+    store.publish('empresa', PAYABLES)
+    return store.open('empresa').select(None)
+
+
+def test_find_matches_many_mantem_resultados_originais(payables):
+    resultados = PayableMatcher(payables).find_matches_many(REGISTROS)
+
+    assert [resumo(r) for r in resultados] == ESPERADO
+    assert [r['total_payables_checked'] for r in resultados] == [len(PAYABLES)] * len(REGISTROS)
+    assert all(m['payable'] == PAYABLES[int(m['payable']['id']) - 1]
+               for r in resultados for m in r['exact_matches'] + r['partial_matches'])
+
+
+def test_find_matches_mantem_resultados_originais(payables):
+    matcher = PayableMatcher(payables)
+    assert [resumo(matcher.find_matches(r)) for r in REGISTROS] == ESPERADO
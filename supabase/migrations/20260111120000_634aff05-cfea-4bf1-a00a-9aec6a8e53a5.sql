@@ -0,0 +1,78 @@
+-- Notifica a API de faturas (POST /payables/changed) quando os payables de uma
+-- empresa mudam, para invalidar o cache do /match e o snapshot compartilhado.
+-- O frontend grava payables direto no Supabase, sem passar pela API.
+--
+-- Configuração (Vault), uma vez por ambiente:
+--   SELECT vault.create_secret('https://invoice-api.exemplo.com', 'invoice_api_url');
+--   SELECT vault.create_secret('<mesmo valor de PAYABLES_WEBHOOK_SECRET>', 'invoice_api_webhook_secret');
+-- Sem os dois segredos, o trigger não faz nada.
+
+CREATE EXTENSION IF NOT EXISTS pg_net WITH SCHEMA extensions;
+
+CREATE OR REPLACE FUNCTION public.notify_payables_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+  api_url TEXT;
+  api_secret TEXT;
+  companies uuid[];
+  changed_company uuid;
+BEGIN
+  SELECT decrypted_secret INTO api_url
+  FROM vault.decrypted_secrets WHERE name = 'invoice_api_url';
+  SELECT decrypted_secret INTO api_secret
+  FROM vault.decrypted_secrets WHERE name = 'invoice_api_webhook_secret';
+
+  IF api_url IS NULL OR api_secret IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  -- Uma notificação por empresa afetada pelo comando (não por linha)
+  IF TG_OP = 'INSERT' THEN
+    SELECT array_agg(DISTINCT company_id) INTO companies FROM changed_payables_new;
+  ELSIF TG_OP = 'UPDATE' THEN
+    SELECT array_agg(DISTINCT company_id) INTO companies FROM (
+      SELECT company_id FROM changed_payables_new
+      UNION
+      SELECT company_id FROM changed_payables_old
+    ) c;
+  ELSE
+    SELECT array_agg(DISTINCT company_id) INTO companies FROM changed_payables_old;
+  END IF;
+
+  FOREACH changed_company IN ARRAY coalesce(companies, '{}'::uuid[])
+  LOOP
+    PERFORM net.http_post(
+      url := rtrim(api_url, '/') || '/payables/changed',
+      body := jsonb_build_object('company_id', changed_company),
+      headers := jsonb_build_object(
+        'Content-Type', 'application/json',
+        'X-Webhook-Secret', api_secret
+      )
+    );
+  END LOOP;
+
+  RETURN NULL;
+EXCEPTION WHEN OTHERS THEN
+  -- A notificação nunca impede a gravação; o cache expira pelo TTL
+  RAISE WARNING 'notify_payables_changed: %', SQLERRM;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS notify_payables_changed_insert ON public.payables;
+CREATE TRIGGER notify_payables_changed_insert
+AFTER INSERT ON public.payables
+REFERENCING NEW TABLE AS changed_payables_new
+FOR EACH STATEMENT EXECUTE FUNCTION public.notify_payables_changed();
+
+DROP TRIGGER IF EXISTS notify_payables_changed_update ON public.payables;
+CREATE TRIGGER notify_payables_changed_update
+AFTER UPDATE ON public.payables
+REFERENCING OLD TABLE AS changed_payables_old NEW TABLE AS changed_payables_new
+FOR EACH STATEMENT EXECUTE FUNCTION public.notify_payables_changed();
+
+DROP TRIGGER IF EXISTS notify_payables_changed_delete ON public.payables;
+CREATE TRIGGER notify_payables_changed_delete
+AFTER DELETE ON public.payables
+REFERENCING OLD TABLE AS changed_payables_old
+FOR EACH STATEMENT EXECUTE FUNCTION public.notify_payables_changed();